@@ -2,13 +2,20 @@
 ************* DatabaseConnections *************
 * Import den med 'from LK_DatabaseConnections import DBConnect'
 * Opret et DBConnect-objekt med 'db = DBConnect(database, server, username, password)'
+* Brug 'with DBConnect(database, server) as db:' eller kald db.close() for at lukke forbindelsen igen
 * Brug metoden db.engine() til at oprette et SQLAlchemy engine-objekt
 * Brug metoden db.cursor() til at hente en database-cursor
 * Brug metoden db.fast_engine() til at oprette et SQLAlchemy engine-objekt med 'fast_executemany' aktiveret
 * Brug metoden db.conn() til at hente den aktuelle ODBC-forbindelse
 * Brug metoden db.tables(schema) til at hente en liste over tabeller i databasen
 * Brug metoden db.columns(table, schema) til at hente en liste over kolonner i en tabel
+* Brug metoden db.query_arrow(sql, params) til at hente et resultat som en pyarrow.Table (kræver arrow-odbc)
+* Brug metoderne db.tables_df(schema) og db.columns_df(table, schema) for at få resultatet som en pandas DataFrame
+* Forbindelser genbruges via SQLAlchemy's QueuePool (se engine()). ODBC driver manager pooling er slået fra,
+  da den sammen med pyodbc kan give hukommelseslæk på Linux/unixODBC. Den kan slås til med 'pyodbc_pooling' i DatabaseConnections_args.json
 * Brug metoden db.statistik(gruppenavn, navn, id, status, interval, runtime, featuresRead, featuresWritten) til at logge statistik for en Data-jobkørsel
+* Brug metoden db.statistik_batch(records) til at logge statistik for flere Data-jobkørsler på én gang
+* Brug metoden db.bulk_insert(table, columns, rows) til at indsætte mange rækker hurtigt via ODBC-forbindelsen
 """
 import urllib.parse
 from sqlalchemy import create_engine
@@ -16,9 +23,48 @@ from sqlalchemy.types import *
 from sqlalchemy import event
 import pyodbc
 import urllib
+import threading
 import json
 import os
 import pandas as pd
+try:
+    import pyarrow as pa
+    from arrow_odbc import read_arrow_batches_from_odbc
+except ImportError:
+    pa = None
+    read_arrow_batches_from_odbc = None
+
+## indstillingerne læses én gang, når modulet importeres
+_ARGS_PATH = os.path.join(os.path.dirname(__file__), 'DatabaseConnections_args.json')
+with open(_ARGS_PATH, 'r') as f:
+    _ARGS = json.load(f)
+
+## ODBC driver manager pooling er slået fra som standard, så forbindelser kun genbruges via SQLAlchemy's QueuePool
+pyodbc.pooling = bool(_ARGS.get('pyodbc_pooling', False))
+
+## faste forespørgsler til tables() og columns(), parametriseret så SQL Server kan genbruge planen
+_TABLES_ALL = """SELECT TABLE_SCHEMA AS Schema_name
+                    , TABLE_NAME AS Table_name
+                    FROM INFORMATION_SCHEMA.TABLES
+                    WHERE TABLE_TYPE = 'BASE TABLE'
+                    ORDER BY TABLE_SCHEMA, TABLE_NAME"""
+
+_TABLES_BY_SCHEMA = """SELECT TABLE_SCHEMA AS Schema_name
+                    , TABLE_NAME AS Table_name
+                    FROM INFORMATION_SCHEMA.TABLES
+                    WHERE TABLE_TYPE = 'BASE TABLE'
+                        AND TABLE_SCHEMA = ?
+                    ORDER BY TABLE_SCHEMA, TABLE_NAME"""
+
+_COLUMNS = """SELECT ORDINAL_POSITION
+                        , COLUMN_NAME
+                        , DATA_TYPE
+                        , CHARACTER_MAXIMUM_LENGTH
+                        , IS_NULLABLE
+                    FROM INFORMATION_SCHEMA.COLUMNS
+                    WHERE TABLE_NAME = ?
+                        AND TABLE_SCHEMA = ?
+                    ORDER BY ORDINAL_POSITION"""
 
 class DBConnect:
     """
@@ -39,6 +85,9 @@ class DBConnect:
         Adgangskoden til SQL Server-godkendelse. Bruges kun, hvis et brugernavn er angivet.
     """
 
+    ## forbindelser til statistik-databasen pr. tråd og nøglet på (server, database); pyodbc-forbindelser må ikke deles mellem tråde
+    __stats_local = threading.local()
+
     def __init__(self, database, server, username=None, password=None):
         """
         Initialiserer DBConnect-objektet og opretter en forbindelse til SQL Server-databasen.
@@ -54,33 +103,108 @@ class DBConnect:
         password : str, valgfri
             Adgangskoden til SQL Server-godkendelse. Bruges kun, hvis et brugernavn er angivet.
         """
-        module_dir = os.path.dirname(__file__)
-        args_path = os.path.join(module_dir, 'DatabaseConnections_args.json')
-        with open(args_path, 'r') as f:
-            self.__args = json.load(f)
+        self.__args = _ARGS
         self.database = database
         self.server = server
         self.username = username
         self.password = password
-        self.__driver = 'ODBC Driver 17 for SQL Server'
+        self.__driver = self.__get_driver()
         self.__params = 'DRIVER=' + self.__driver + ';SERVER=' + self.server + ';PORT=1433;DATABASE=' + self.database
+        self.__params += ';Packet Size=' + str(self.__args.get('packet_size', 32767))
+        if self.__args.get('mars', True):
+            self.__params += ';MARS_Connection=yes'
+        if self.__driver == 'ODBC Driver 18 for SQL Server':
+            self.__params += ';Encrypt=yes;TrustServerCertificate=yes'
         if self.username is None or self.password is None:
             self.__params += ';Trusted_Connection=yes'
         else:
             self.__params += ';UID=' + username + ';PWD=' + password
         self.__cnxn = pyodbc.connect(self.__params)
         self.__db_params = urllib.parse.quote_plus(self.__params)
+        self.__engine = None
+        self.__fast_engine = None
+        self.__engine_lock = threading.Lock()
         
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Lukker ODBC-forbindelsen og frigiver forbindelsespuljerne i de oprettede engine-objekter.
+
+        Kaldes automatisk, når objektet bruges i en 'with'-blok.
+        """
+        try:
+            if getattr(self, '_DBConnect__cnxn', None) is not None:
+                self.__cnxn.close()
+                self.__cnxn = None
+        finally:
+            if getattr(self, '_DBConnect__engine', None) is not None:
+                self.__engine.dispose()
+                self.__engine = None
+            if getattr(self, '_DBConnect__fast_engine', None) is not None:
+                self.__fast_engine.dispose()
+                self.__fast_engine = None
+
+    def __get_driver(self):
+        """
+        Finder den ODBC-driver, der skal bruges til forbindelsen.
+
+        Driveren kan angives med 'driver' i DatabaseConnections_args.json. Ellers bruges
+        'ODBC Driver 18 for SQL Server', hvis den er installeret, og ellers 'ODBC Driver 17 for SQL Server'.
+
+        Returnerer:
+        -----------
+        str
+            Navnet på ODBC-driveren.
+        """
+        if self.__args.get('driver'):
+            return self.__args['driver']
+        if 'ODBC Driver 18 for SQL Server' in pyodbc.drivers():
+            return 'ODBC Driver 18 for SQL Server'
+        return 'ODBC Driver 17 for SQL Server'
+
+    def __pool_args(self):
+        """
+        Samler indstillingerne til SQLAlchemy's forbindelsespulje fra DatabaseConnections_args.json.
+
+        Returnerer:
+        -----------
+        dict
+            Nøgleordsargumenter til create_engine.
+        """
+        return {
+            'pool_size': int(self.__args.get('pool_size', 20)),
+            'max_overflow': int(self.__args.get('max_overflow', 10)),
+            'pool_timeout': int(self.__args.get('pool_timeout', 30)),
+            'pool_recycle': int(self.__args.get('pool_recycle', 1800)),
+            'pool_pre_ping': True,
+        }
+
     def engine(self):
         """
         Opretter og returnerer et SQLAlchemy engine-objekt til forbindelse med SQL Server-databasen.
 
+        Engine-objektet oprettes kun første gang metoden kaldes og genbruges derefter,
+        så forbindelsespuljen deles mellem alle kald. Oprettelsen er beskyttet af en lås,
+        så flere tråde ikke opretter hver deres engine.
+
+        Størrelsen på forbindelsespuljen styres med 'pool_size', 'max_overflow', 'pool_timeout'
+        og 'pool_recycle' i DatabaseConnections_args.json (standard: 20/10/30/1800).
+
         Returnerer:
         -----------
         sqlalchemy.engine.Engine
             Et SQLAlchemy engine-objekt, der kan bruges til at interagere med databasen.
         """
-        return create_engine("mssql+pyodbc:///?odbc_connect={}".format(self.__db_params))
+        if self.__engine is None:
+            with self.__engine_lock:
+                if self.__engine is None:
+                    self.__engine = create_engine("mssql+pyodbc:///?odbc_connect={}".format(self.__db_params), **self.__pool_args())
+        return self.__engine
 
     def cursor(self):
         """
@@ -97,12 +221,19 @@ class DBConnect:
         """
         Opretter og returnerer et SQLAlchemy engine-objekt med `fast_executemany` aktiveret til bulk-indlæsningsoperationer.
 
+        Engine-objektet oprettes kun første gang metoden kaldes og genbruges derefter.
+        Forbindelsespuljen konfigureres på samme måde som i engine().
+
         Returnerer:
         -----------
         sqlalchemy.engine.Engine
             Et SQLAlchemy engine-objekt med hurtig indlæsningsfunktionalitet.
         """
-        return create_engine("mssql+pyodbc:///?odbc_connect={}".format(self.__db_params), fast_executemany=True)
+        if self.__fast_engine is None:
+            with self.__engine_lock:
+                if self.__fast_engine is None:
+                    self.__fast_engine = create_engine("mssql+pyodbc:///?odbc_connect={}".format(self.__db_params), fast_executemany=True, **self.__pool_args())
+        return self.__fast_engine
 
     def conn(self):
         """
@@ -115,7 +246,7 @@ class DBConnect:
         """
         return self.__cnxn
     
-    def tables(self, schema=None):
+    def tables(self, schema=None, reader=None):
         """
         Henter en liste over tabeller i databasen.
 
@@ -123,23 +254,34 @@ class DBConnect:
         ----------
         schema : str, valgfri
             Navnet på skemaet, som tabellerne skal hentes fra. Hvis ikke angivet, hentes tabeller fra alle skemaer.
+        reader : str, valgfri
+            Sæt til 'arrow' for at hente resultatet som en pyarrow.Table via query_arrow().
 
         Returnerer:
         -----------
         list
-            En liste over tabeller i databasen.
+            En liste over tabeller i databasen som ordbøger med nøglerne Schema_name og Table_name.
         """
-        sql = f"""SELECT TABLE_SCHEMA AS Schema_name
-                    , TABLE_NAME AS Table_name
-                    FROM INFORMATION_SCHEMA.TABLES
-                    WHERE TABLE_TYPE = 'BASE TABLE'"""
         if schema is not None:
-            sql += f" AND TABLE_SCHEMA = '{schema}'"
-        sql += " ORDER BY TABLE_SCHEMA, TABLE_NAME"
-        df = pd.read_sql(sql, self.engine())
-        return df
+            sql, params = _TABLES_BY_SCHEMA, (schema,)
+        else:
+            sql, params = _TABLES_ALL, ()
+        if reader == 'arrow':
+            return self.query_arrow(sql, params)
+        return self.__query(sql, params)
+
+    def tables_df(self, schema=None):
+        """
+        Henter tabellerne i databasen som en pandas DataFrame. Se tables().
+
+        Returnerer:
+        -----------
+        pandas.DataFrame
+            En DataFrame med kolonnerne Schema_name og Table_name.
+        """
+        return pd.DataFrame(self.tables(schema), columns=['Schema_name', 'Table_name'])
     
-    def columns(self, table, schema):
+    def columns(self, table, schema, reader=None):
         """
         Henter en liste over kolonner i en tabel.
 
@@ -149,23 +291,75 @@ class DBConnect:
             Navnet på tabellen, som kolonnerne skal hentes fra.
         schema : str, valgfri
             Navnet på skemaet, som tabellen tilhører. Hvis ikke angivet, antages tabellen at være i standard-skemaet.
+        reader : str, valgfri
+            Sæt til 'arrow' for at hente resultatet som en pyarrow.Table via query_arrow().
 
         Returnerer:
         -----------
         list
-            En liste over kolonner i tabellen.
+            En liste over kolonner i tabellen som ordbøger, én pr. kolonne.
         """
-        sql = f"""SELECT ORDINAL_POSITION
-                        , COLUMN_NAME
-                        , DATA_TYPE
-                        , CHARACTER_MAXIMUM_LENGTH
-                        , IS_NULLABLE
-                    FROM INFORMATION_SCHEMA.COLUMNS
-                    WHERE TABLE_NAME = '{table}'
-                        AND TABLE_SCHEMA = '{schema}'
-                    ORDER BY ORDINAL_POSITION"""
-        df = pd.read_sql(sql, self.engine())
-        return df
+        if reader == 'arrow':
+            return self.query_arrow(_COLUMNS, (table, schema))
+        return self.__query(_COLUMNS, (table, schema))
+
+    def columns_df(self, table, schema):
+        """
+        Henter kolonnerne i en tabel som en pandas DataFrame. Se columns().
+
+        Returnerer:
+        -----------
+        pandas.DataFrame
+            En DataFrame med en række pr. kolonne i tabellen.
+        """
+        return pd.DataFrame(self.columns(table, schema), columns=['ORDINAL_POSITION', 'COLUMN_NAME', 'DATA_TYPE', 'CHARACTER_MAXIMUM_LENGTH', 'IS_NULLABLE'])
+
+    def query_arrow(self, sql, params=(), batch_size=65536):
+        """
+        Udfører en forespørgsel og henter resultatet kolonnevis direkte i Arrow-buffere via arrow-odbc.
+
+        Kræver at pyarrow og arrow-odbc er installeret.
+
+        Parametre:
+        ----------
+        sql : str
+            SQL-forespørgslen, evt. med '?' som pladsholdere.
+        params : tuple, valgfri
+            Værdier til pladsholderne i sql.
+        batch_size : int, valgfri
+            Antal rækker der hentes pr. batch (standard: 65536).
+
+        Returnerer:
+        -----------
+        pyarrow.Table
+            Resultatet af forespørgslen.
+        """
+        if read_arrow_batches_from_odbc is None:
+            raise ImportError('pyarrow og arrow-odbc skal være installeret for at bruge query_arrow')
+        reader = read_arrow_batches_from_odbc(
+            query=sql,
+            connection_string=self.__params,
+            batch_size=batch_size,
+            parameters=[str(p) for p in params] if params else None,
+        )
+        return pa.Table.from_batches(reader, schema=reader.schema)
+
+    def __query(self, sql, params=()):
+        """
+        Udfører en forespørgsel direkte på ODBC-forbindelsen uden om pandas og SQLAlchemy.
+
+        Returnerer:
+        -----------
+        list
+            En liste af ordbøger, én pr. række, med kolonnenavne som nøgler.
+        """
+        cursor = self.__cnxn.cursor()
+        try:
+            cursor.execute(sql, *params)
+            columns = [d[0] for d in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
 
     def statistik(self, gruppenavn, navn, id, status, interval, runtime, featuresRead={}, featuresWritten={}):
         """
@@ -190,49 +384,151 @@ class DBConnect:
         featuresWritten : dict, valgfri
             En ordbog med antal skrevne features, grupperet efter feature-type.
         """
+        ## attributterne sættes fra den indsatte række, så totaler og JSON kun beregnes én gang
+        row = self.__log_statistik([{
+            'gruppenavn': gruppenavn,
+            'navn': navn,
+            'id': id,
+            'status': status,
+            'interval': interval,
+            'runtime': runtime,
+            'featuresRead': featuresRead,
+            'featuresWritten': featuresWritten,
+        }])
         self.gruppenavn = gruppenavn
         self.id = id
         self.navn = navn
         self.status = status
         self.interval = interval
         self.runtime = runtime
-        self.totalFeaturesRead = sum(featuresRead.values())
-        self.totalFeaturesWritten = sum(featuresWritten.values())
-        self.featuresRead = json.dumps(featuresRead)
-        self.featuresWritten = json.dumps(featuresWritten)
-
-        sql = f"""INSERT INTO {self.__args['statestik_tabel']}
-                    (OBJECTID
-                    , gruppenavn
-                    , dato
-                    , id
-                    , navn
-                    , status
-                    , runtime
-                    , featuresWritten
-                    , totalFeaturesWritten
-                    , interval
-                    , featuresRead
-                    , totalFeaturesRead) 
-                VALUES (
-                    (SELECT MAX(OBJECTID) FROM {self.__args['statestik_tabel']})+1
-                    , '{self.gruppenavn}'
-                    , GETDATE()
-                    , '{self.id}'
-                    , '{self.navn}'
-                    , '{self.status}'
-                    , {self.runtime}
-                    , '{self.featuresWritten}'
-                    , {self.totalFeaturesWritten}
-                    , '{self.interval}'
-                    , '{self.featuresRead}'
-                    , {self.totalFeaturesRead}
-                    )"""
-        
-        connection = DBConnect(server=self.__args['statestik_server'] , database=self.__args['statestik_database'])
+        self.totalFeaturesRead = row['totalFeaturesRead']
+        self.totalFeaturesWritten = row['totalFeaturesWritten']
+        self.featuresRead = row['featuresRead']
+        self.featuresWritten = row['featuresWritten']
+
+    def statistik_batch(self, records, batch_size=10000):
+        """
+        Logger statistik for flere Data-jobkørsler i GeoData databasen med én forbindelse.
+        Hver tråd har sin egen forbindelse til statistik-databasen, der oprettes første gang og genbruges derefter.
+        Er forbindelsen tabt (pyodbc.OperationalError), oprettes den igen og batchen forsøges én gang til.
+
+        Tidspunktet findes med ét enkelt opslag for hele batchen, og rækkerne indsættes med
+        bulk_insert(), så der kun er få rundture til serveren. Hvis OBJECTID tildeles af serveren
+        (se statistik_objectid_sequence.sql), udelades den i INSERT; ellers findes MAX(OBJECTID)
+        én gang pr. batch.
+
+        Parametre:
+        ----------
+        records : list
+            En liste af ordbøger med nøglerne 'gruppenavn', 'navn', 'id', 'status', 'interval', 'runtime'
+            og eventuelt 'featuresRead' og 'featuresWritten' (samme betydning som i statistik()).
+        batch_size : int, valgfri
+            Antal rækker der sendes til serveren ad gangen (standard: 10000).
+        """
+        if len(records) == 0:
+            return
+        self.__log_statistik(records, batch_size)
+
+    def __log_statistik(self, records, batch_size=10000):
+        """
+        Indsætter records via trådens forbindelse til statistik-databasen og returnerer den sidste række som ordbog.
+        """
+        key = (self.__args['statestik_server'], self.__args['statestik_database'])
+        try:
+            return self.__insert_statistik(self.__stats_connection(key), records, batch_size)
+        except pyodbc.OperationalError:
+            ## forbindelsen er tabt, fx efter en genstart af serveren; der er ikke committet, så batchen sendes igen
+            return self.__insert_statistik(self.__stats_connection(key, reconnect=True), records, batch_size)
+
+    def __stats_connection(self, key, reconnect=False):
+        """
+        Returnerer trådens forbindelse til statistik-databasen og opretter den første gang, eller igen når reconnect er True.
+        """
+        connections = getattr(DBConnect.__stats_local, 'connections', None)
+        if connections is None:
+            connections = DBConnect.__stats_local.connections = {}
+        connection = connections.get(key)
+        if connection is not None and reconnect:
+            try:
+                connection.close()
+            except pyodbc.Error:
+                pass
+            connection = None
+        if connection is None:
+            connection = DBConnect(server=key[0], database=key[1])
+            connections[key] = connection
+        return connection
+
+    def __insert_statistik(self, connection, records, batch_size):
+        """
+        Indsætter statistikrækkerne for records via connection. Se statistik_batch().
+
+        Returnerer:
+        -----------
+        dict
+            Den sidst indsatte række med kolonnenavne som nøgler.
+        """
+        tabel = self.__args['statestik_tabel']
         cursor = connection.cursor()
-        cursor.execute(sql)
-        cursor.commit()
+        ## tjek om OBJECTID tildeles af serveren (IDENTITY eller sekvens, se statistik_objectid_sequence.sql)
+        dato, auto_id = cursor.execute("""SELECT GETDATE(), (SELECT COUNT(*) FROM sys.columns
+                                            WHERE object_id = OBJECT_ID(?)
+                                                AND name = 'OBJECTID'
+                                                AND (is_identity = 1 OR default_object_id <> 0))""", tabel).fetchone()
+        if not auto_id:
+            max_id = cursor.execute(f"SELECT ISNULL(MAX(OBJECTID), 0) FROM {tabel}").fetchval()
+
+        rows = []
+        for i, record in enumerate(records, start=1):
+            featuresRead = record.get('featuresRead', {})
+            featuresWritten = record.get('featuresWritten', {})
+            row = (
+                record['gruppenavn'],
+                dato,
+                record['id'],
+                record['navn'],
+                record['status'],
+                record['runtime'],
+                json.dumps(featuresWritten, separators=(',', ':'), ensure_ascii=False),
+                sum(featuresWritten.values()),
+                record['interval'],
+                json.dumps(featuresRead, separators=(',', ':'), ensure_ascii=False),
+                sum(featuresRead.values()),
+            )
+            if not auto_id:
+                row = (max_id + i,) + row
+            rows.append(row)
 
+        columns = ['gruppenavn', 'dato', 'id', 'navn', 'status', 'runtime',
+                   'featuresWritten', 'totalFeaturesWritten', 'interval', 'featuresRead', 'totalFeaturesRead']
+        if not auto_id:
+            columns = ['OBJECTID'] + columns
+        connection.bulk_insert(tabel, columns, rows, batch_size)
+        return dict(zip(columns, rows[-1]))
 
+    def bulk_insert(self, table, columns, rows, batch_size=10000):
+        """
+        Indsætter mange rækker i en tabel direkte via ODBC-forbindelsen med 'fast_executemany'.
 
+        Rækkerne sendes som parameter-arrays uden om SQLAlchemy, så hver batch kun kræver én rundtur til serveren.
+
+        Parametre:
+        ----------
+        table : str
+            Navnet på tabellen, evt. med skema, f.eks. 'dbo.tabel'.
+        columns : list
+            En liste med kolonnenavne i samme rækkefølge som værdierne i rows.
+        rows : list
+            En liste af tupler med de værdier, der skal indsættes.
+        batch_size : int, valgfri
+            Antal rækker der sendes til serveren ad gangen (standard: 10000).
+        """
+        if len(rows) == 0:
+            return
+        placeholders = ', '.join(['?'] * len(columns))
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        cursor = self.__cnxn.cursor()
+        cursor.fast_executemany = True
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, rows[start:start + batch_size])
+        cursor.commit()
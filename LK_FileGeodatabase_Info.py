@@ -4,13 +4,25 @@
 * Opret et gdb_info-objekt med 'gdb = gdb_info(gdb)'
 * Få information om lagene i geodatabasen med 'gdb.info()'
 * Få skemaet for et specifikt lag med 'gdb.schema(layernumber)'
-* Konverter et lag til en GeoDataFrame med 'gdb.to_geodataframe(idx)'
+* Konverter et lag til en GeoDataFrame med 'gdb.to_geodataframe(idx, columns)'
+* Konverter flere lag samtidigt med 'gdb.to_geodataframes([idx1, idx2], max_workers)'
 
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 import geopandas as gpd
 import fiona
+try:
+    import pyogrio
+    _HAS_PYOGRIO = True
+except ImportError:
+    _HAS_PYOGRIO = False
+try:
+    import pyarrow
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
 
 class gdb_info:
     """
@@ -34,8 +46,10 @@ class gdb_info:
         Hvis 'fields' er True, inkluderes felterne i lagene.
     schema(self, layernumber):
         Returnerer skemaet for et specifikt lag i File Geodatabase.
-    to_geodataframe(self, idx):
+    to_geodataframe(self, idx, columns=None):
         Konverterer et specifikt lag i File Geodatabase til en GeoDataFrame.
+    to_geodataframes(self, idxs, max_workers=4):
+        Konverterer flere lag i File Geodatabase til GeoDataFrames parallelt.
     """
     def __init__(self, gdb):
         self.gdb = gdb
@@ -43,6 +57,13 @@ class gdb_info:
         self.gdb_path = os.path.dirname(gdb)
         self.gdb_files = [(i, layername) for i, layername in enumerate(fiona.listlayers(gdb))]
 
+        ## lagenes oplysninger gemmes som parallelle lister (navn, type, geometri, felter).
+        ## Type, geometri og felter læses først når de skal bruges, så et lag kun åbnes én gang
+        self.__names = [layername for i, layername in self.gdb_files]
+        self.__types = [None] * len(self.__names)
+        self.__geoms = [None] * len(self.__names)
+        self.__fields = [None] * len(self.__names)
+
     def info(self, idx=None, fields=False):
         """
         Henter information om lagene i en geodatabase.
@@ -56,52 +77,72 @@ class gdb_info:
                   om det specifikke lag.
         """
 
-        layers = {}
         if idx is None:
-            for i, layername in enumerate(fiona.listlayers(self.gdb)):
-                layer = {'Layername': layername}
-                schema = self.schema(i)
-                if schema['geometry'] == 'None':
-                    layer['Type'] = 'Table'
-                else:
-                    layer['Type'] = 'Featureclass'
-                    layer['Geometry'] = schema['geometry']
-
-                if fields:
-                    layer['Fields'] = schema['properties']
-                layers[i] = layer
-            return layers
+            return {i: self.__layer_info(i, fields) for i in range(len(self.__names))}
         else:
-            layer = {'Layername': fiona.listlayers(self.gdb)[idx]}
-            schema = self.schema(idx)
-            if schema['geometry'] == 'None':
-                layer['Type'] = 'Table'
-            else:
-                layer['Type'] = 'Featureclass'
-                layer['Geometry'] = schema['geometry']
-            if fields:
-                layer['Fields'] = schema['properties']
-            return layer
+            return self.__layer_info(idx, fields)
+
+    def __layer_info(self, idx, fields):
+        """
+        Samler information om et enkelt lag ud fra de parallelle lister.
+        """
+        self.__load_schema(idx)
+        layer = {'Layername': self.__names[idx], 'Type': self.__types[idx]}
+        if self.__types[idx] == 'Featureclass':
+            layer['Geometry'] = self.__geoms[idx]
+        if fields:
+            layer['Fields'] = self.__fields[idx]
+        return layer
+
+    def __load_schema(self, idx):
+        """
+        Læser skemaet for et lag, hvis det ikke allerede er læst.
+        """
+        if self.__types[idx] is None:
+            with fiona.open(self.gdb, layer=idx) as src:
+                schema = src.schema
+            self.__geoms[idx] = schema['geometry']
+            self.__fields[idx] = schema['properties']
+            self.__types[idx] = 'Table' if schema['geometry'] == 'None' else 'Featureclass'
 
     def schema(self, layernumber):
         """
         Henter skemaet for et bestemt lag i en geodatabase.
+        Skemaet læses kun første gang det efterspørges og genbruges derefter.
         Args:
             layernumber (int): Nummeret på laget i geodatabasen, som skemaet skal hentes for.
         Returns:
             dict: Et ordbog, der repræsenterer skemaet for det angivne lag.
         """
 
-        schema = fiona.open(self.gdb, layer=layernumber).schema
-        return schema
+        self.__load_schema(layernumber)
+        return {'properties': self.__fields[layernumber], 'geometry': self.__geoms[layernumber]}
     
-    def to_geodataframe(self, idx):
+    def to_geodataframe(self, idx, columns=None):
         """
         Konverterer en specifik lag fra en filgeodatabase til en GeoDataFrame.
+        Bruger pyogrio (og Arrow, hvis pyarrow er installeret), hvis det er tilgængeligt, ellers Fiona.
         Parametre:
         idx (int): Indekset for laget i filgeodatabasen, der skal konverteres.
+        columns (list, optional): Liste over felter der skal læses. Hvis None, læses alle felter.
         Returnerer:
         GeoDataFrame: En GeoDataFrame, der repræsenterer det specificerede lag.
         """
 
-        return gpd.read_file(self.gdb, layer=idx)
\ No newline at end of file
+        if _HAS_PYOGRIO:
+            return gpd.read_file(self.gdb, layer=idx, engine='pyogrio', use_arrow=_HAS_PYARROW, columns=columns)
+        return gpd.read_file(self.gdb, layer=idx, include_fields=columns)
+
+    def to_geodataframes(self, idxs, max_workers=4):
+        """
+        Konverterer flere lag fra en filgeodatabase til GeoDataFrames parallelt.
+        GDAL frigiver GIL'en under indlæsningen, så lagene kan læses samtidigt i tråde.
+        Parametre:
+        idxs (list): Liste med indeks for de lag, der skal konverteres.
+        max_workers (int, optional): Maks antal tråde der bruges. Standard er 4.
+        Returnerer:
+        list: En liste med GeoDataFrames i samme rækkefølge som idxs.
+        """
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.to_geodataframe, idxs))
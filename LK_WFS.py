@@ -10,14 +10,16 @@ Denne klasse giver mulighed for at:
 
 Parametre:
     url (str): URL til WFS-tjenesten
-    **kwargs: Valgfri parametre der kan inkludere:
+    Valgfri nøgleordsparametre:
         username (str): Brugernavn til autentificering
         password (str): Adgangskode til autentificering 
         bbox (list): Afgrænsningsboks [minx, miny, maxx, maxy]
         version (str): WFS version (default: nyeste tilgængelige)
         maxfeatures (int): Maks antal objekter der hentes
         debug (bool): Aktiver debug output
-        outputFormat (str): Ønsket output format
+        outputFormat (str): Ønsket output format (default: JSON hvis tjenesten understøtter det)
+        max_workers (int): Maks antal samtidige forespørgsler når data hentes (default: 8)
+        cache_dir (str): Mappe til GetCapabilities cache på disken (valgfri)
 
 Eksempel:
     >>> wfs = WFS('https://example.com/wfs', 
@@ -27,16 +29,128 @@ Eksempel:
     >>> gdf = wfs.get_feature('kommuner')
 
 Bemærk:
-    Kræver geopandas, pandas, requests, lxml, shapely og fiona installeret
+    Kræver geopandas, pandas, requests, lxml, shapely, pyproj og pyogrio eller fiona installeret
 """
 import pandas as pd
 import geopandas as gpd
-import fiona
-fiona.drvsupport.supported_drivers['WFS'] = 'r'
 import requests
-from xml.etree import ElementTree as ET
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import io
+import os
+import json
+import hashlib
+import copy
+import time
+import threading
+import weakref
+import math
+from collections import OrderedDict
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import lxml.etree as etree
-from shapely.geometry import box
+import shapely
+import pyproj
+try:
+    import pyogrio
+    _READ_ENGINE = {'engine': 'pyogrio'}
+    try:
+        import pyarrow
+        ## med pyarrow læses svaret kolonnevis i stedet for feature for feature
+        _READ_ENGINE['use_arrow'] = True
+    except ImportError:
+        pass
+except ImportError:
+    _READ_ENGINE = {}
+
+## CRS og transformer oprettes én gang, så PROJ ikke skal initialiseres ved hvert kald
+_CRS_25832 = pyproj.CRS.from_epsg(25832)
+_TRANSFORMER_4326_TO_25832 = pyproj.Transformer.from_crs("EPSG:4326", _CRS_25832, always_xy=True)
+
+## timeouts (connect, read) i sekunder; GetFeature kan tage længere tid end metadata-forespørgslerne
+_TIMEOUT = (5, 60)
+_FEATURE_TIMEOUT = (5, 300)
+## pandas før 3.0 kopierer data i pd.concat medmindre copy=False; fra 3.0 er det copy-on-write og argumentet udgår
+_CONCAT_KWARGS = {'copy': False} if int(pd.__version__.split('.')[0]) < 3 else {}
+
+## kolonner med et unikt feature id; gml_id fra GML-svar og fid fra bl.a. GeoServers JSON, i prioriteret rækkefølge
+_ID_COLUMNS = ('gml_id', 'fid')
+
+## maks antal hits der huskes pr. instans; de længst ubrugte smides ud først
+_HITS_CACHE_SIZE = 4096
+
+## delbboxe hentes uden hits-forespørgsel, når det forventede antal features er under denne andel af maxfeatures
+_SKIP_HITS_RATIO = 0.8
+
+## antal sekunder et GetCapabilities svar genbruges uden at spørge tjenesten igen
+_CAPABILITIES_MAX_AGE = 3600
+
+## parserindstillinger: store dokumenter tillades, id-tabellen og tomme tekstnoder bygges ikke
+_PARSER_OPTIONS = {'huge_tree': True, 'collect_ids': False, 'remove_blank_text': True}
+## genbrugt parser til DescribeFeatureType; den bruges kun fra den tråd der kalder get_feature
+_XML_PARSER = etree.XMLParser(**_PARSER_OPTIONS)
+
+## de underelementer af FeatureType der bruges fra GetCapabilities
+_FEATURE_TYPE_TAGS = ('{*}Name', '{*}Title', '{*}LowerCorner', '{*}UpperCorner', '{*}LatLongBoundingBox')
+
+## XPath til elementerne i DescribeFeatureType kompileres én gang med XML Schema namespacet, 
+## så lxml matcher på navn i stedet for at kalde local-name() for hvert element
+_XP_SCHEMA_ELEMENTS = etree.XPath('.//xsd:complexContent//xsd:element', namespaces={'xsd': 'http://www.w3.org/2001/XMLSchema'})
+
+
+def _bbox_param(bbox):
+    """Formaterer en bbox som WFS bbox-parameter; bboxe holdes som floats og laves kun til tekst her."""
+    return ','.join(map(str, bbox))
+
+
+class _LazyCounts(dict):
+    """
+    Dict med antal features pr. feature type, hvor antallet først hentes når det slås op.
+
+    Hentede antal gemmes, så hver feature type kun koster én hits-forespørgsel. 
+    Værdier der endnu ikke er hentet står som None.
+
+    values() og items() henter de manglende antal samtidigt med en trådpulje.
+
+    Parametre:
+        fetch (weakref.WeakMethod): Svag reference til metoden der henter antallet for et navn
+        names (iterable): Navnene på feature typerne
+        max_workers (int): Maks antal samtidige hits-forespørgsler (default: 8)
+    """
+    def __init__(self, fetch, names, max_workers=8):
+        super().__init__((name, None) for name in names)
+        self.__fetch = fetch
+        self.__max_workers = max_workers
+
+    def __fetch_missing(self):
+        missing = [name for name, value in dict.items(self) if value is None]
+        fetch = self.__fetch()
+        if len(missing) < 2 or fetch is None:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.__max_workers, len(missing))) as executor:
+            for name, value in zip(missing, executor.map(fetch, missing)):
+                super().__setitem__(name, value)
+
+    def __getitem__(self, name):
+        value = super().__getitem__(name)
+        if value is None:
+            fetch = self.__fetch()
+            if fetch is None:
+                return None
+            value = fetch(name)
+            super().__setitem__(name, value)
+        return value
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def values(self):
+        self.__fetch_missing()
+        return [self[name] for name in self]
+
+    def items(self):
+        self.__fetch_missing()
+        return [(name, self[name]) for name in self]
 
 
 class WFS:
@@ -48,13 +162,17 @@ class WFS:
 
     Parametre:
         url (str): URL'en til WFS-tjenesten
-        **kwargs: Valgfri nøgleordsargumenter
+        Valgfri nøgleordsparametre:
         - username (str): Brugernavn til autentificering
         - password (str): Adgangskode til autentificering
         - bbox (list): Bounding box koordinater [minx, miny, maxx, maxy], hvis ikke angivet, findes bounding box i GetCapabilities responsen
         - version (str): WFS version, standard er nyeste understøttede, hvis ikke angiivet, findes version i GetCapabilities responsen
         - maxfeatures (int): Maks antal features der hentes, standard er 90% af MaxFeatures i GetCapabilities responsen
         - debug (bool): Aktiver debug output
+        - max_workers (int): Maks antal samtidige forespørgsler når data hentes, standard er 8
+        - outputFormat (str): Ønsket output format, standard er JSON hvis tjenesten understøtter det
+        - params (dict): Ekstra parametre der sendes med alle forespørgsler
+        - cache_dir (str): Mappe hvor GetCapabilities svar gemmes og genbruges på tværs af processer (valgfri)
 
     Attributter:
         - operations (dict): Tilgængelige WFS operationer
@@ -67,61 +185,77 @@ class WFS:
         - get_feature(feature_name): Henter features fra WFS-tjenesten som en GeoDataFrame
             - feature_name (str): Navnet på det ønskede feature lag
             - clip_gdf (bool): Hvis True, klippes GeoDataFrame til bounding box (standard er True)
+        - close(): Lukker HTTP-sessionen og dens forbindelser; kaldes automatisk i en 'with'-blok
     Raises:
         ValueError: Hvis påkrævede parametre mangler eller er ugyldige
     """
-    def __init__(self, url: str, **kwargs):
-        for key, value in kwargs.items():
-            setattr(self, key, value)
-            # print(self, key, value)
-        
-        ## check if debug is set
-        if hasattr(self, 'debug'):
-            self.__debug = self.debug
-        else:
-            self.__debug = False
+    ## faste attributter i stedet for en __dict__ pr. instans
+    __slots__ = (
+        'url', 'username', 'password', 'bbox', 'version', 'maxfeatures', 'outputFormat', 'debug',
+        'operations', 'feature_types', 'bboxes',
+        '__debug', '__max_workers', '__cache_dir', '__session', '__hits_cache', '__hits_lock', '__describe_cache', '__params', '__get_init_count',
+        '__feature_list', '__feature_bboxes', '__count_default', '__feature_translations',
+        '__default_bbox', '__clip_bounds', '__missing_default_bbox', '__weakref__',
+    )
 
-        ## initialize params
+    ## parsede GetCapabilities svar, delt mellem alle instanser
+    __capabilities_cache = {}
+    __capabilities_lock = threading.Lock()
+
+    def __init__(self, url: str, *, username=None, password=None, bbox=None, version=None, maxfeatures=None,
+                 debug=False, outputFormat=None, max_workers=8, params=None, get_init_count=False, cache_dir=None):
         self.url = url
+        self.username = username
+        self.password = password
+        self.bbox = bbox
+        self.version = version
+        self.maxfeatures = maxfeatures
+        self.debug = debug
+        self.outputFormat = outputFormat
+        self.__debug = debug
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError('max_workers must be a positive integer')
+        self.__max_workers = max_workers
+        self.__get_init_count = get_init_count
+        self.__cache_dir = os.path.expanduser(cache_dir) if cache_dir is not None else None
+
+        ## one session for all requests, so connections are kept alive and reused
+        ## the connection pool is as large as the thread pool, so concurrent tile requests don't open new connections
+        self.__session = requests.Session()
+        ## midlertidige serverfejl og throttling forsøges igen med backoff
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+        self.__session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.__hits_cache = OrderedDict()
+        self.__hits_lock = threading.Lock()
+        self.__describe_cache = {}
+
+        ## initialize params
         self.__params = {
             'service': 'WFS',
             'request': 'GetCapabilities',
         }
 
-        if hasattr(self, 'params'):
-            self.__params.update(self.params)
-        
-        ## check if count is set
-        if hasattr(self, 'get_init_count'):
-            self.__get_init_count = self.get_init_count
-        else:
-            self.__get_init_count = False
+        if params is not None:
+            self.__params.update(params)
 
         ## check if username and password are provided together and add to params
-        if (hasattr(self, 'username') and not hasattr(self, 'password')) or (hasattr(self, 'password') and not hasattr(self, 'username')):
+        if (self.username is None) != (self.password is None):
             raise ValueError('Both username and password must be provided')
 
-        if hasattr(self, 'username') and hasattr(self, 'password'):
+        ## brugernavn og adgangskode sendes både som parametre (fx Datafordeleren) og som basic auth
+        if self.username is not None:
             self.__params['username'] = self.username
             self.__params['password'] = self.password
-        else:
-            self.username = None
-            self.password = None
+            self.__session.auth = (self.username, self.password)
 
         ## get capabilities
-        url = requests.Request('GET', self.url, params=self.__params).prepare().url
-        if self.__debug: print('GetCapabilities url:', url)
-        response = requests.get(url)
-        root = etree.XML(response.content)
-        if self.__debug: 
-            print('GetCapabilities response:', root)
-        self.__get_capabilities_root = root
-        
-        ## find all operation names in root element
-        self.operations = self.__get_operation_names()
+        self.operations = self.__load_capabilities()
         if self.__debug: print(f'self.operations: {self.operations}')
 
-        if hasattr(self, 'maxfeatures'):
+        if self.maxfeatures is not None:
             if not isinstance(self.maxfeatures, int):
                 raise ValueError('maxfeatures must be an integer')
             self.operations['MaxFeatures'] = self.maxfeatures
@@ -130,7 +264,7 @@ class WFS:
             self.maxfeatures = self.operations['MaxFeatures'] * .98
         
 
-        if not hasattr(self, 'version'):
+        if self.version is None:
             try:
                 self.version = sorted(self.operations['GetCapabilities']['AcceptVersions'], reverse=True)[0]
             except:
@@ -138,31 +272,172 @@ class WFS:
         elif self.version not in self.operations['GetCapabilities']['AcceptVersions']:
             raise ValueError(f'Version {self.version} not supported. Supported versions are {self.operations["GetCapabilities"]["AcceptVersions"]}')
 
-        if hasattr(self, 'bbox'):
+        ## JSON er hurtigere at parse end GML, så det bruges hvis tjenesten understøtter det og intet format er angivet
+        if self.outputFormat is None:
+            output_formats = self.operations.get('GetFeature', {}).get('outputFormat', [])
+            json_formats = [f for f in output_formats if f and 'json' in f.lower()]
+            if 'application/json' in json_formats:
+                self.outputFormat = 'application/json'
+            elif json_formats:
+                self.outputFormat = json_formats[0]
+            if self.__debug and json_formats: print(f'Using outputFormat: {self.outputFormat}')
+
+        if self.bbox is not None:
             if not isinstance(self.bbox, list):
                 raise ValueError('bbox must be a list of coordinates [minx, miny, maxx, maxy]')
             if len(self.bbox) != 4:
                 raise ValueError('bbox must be a list of coordinates [minx, miny, maxx, maxy]')
             self.bboxes = [[str(b) for b in self.bbox]]
             self.__default_bbox = self.bboxes[0]
+            self.__clip_bounds = tuple(float(coord) for coord in self.__default_bbox)
             self.__missing_default_bbox = False
         else:
             self.bboxes = None
             self.__default_bbox = None
+            self.__clip_bounds = None
             self.__missing_default_bbox = True
     
         self.feature_types = self.__get_feature_types()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Lukker HTTP-sessionen, så de genbrugte keep-alive forbindelser frigives.
+
+        Kaldes automatisk, når objektet bruges i en 'with'-blok.
+        """
+        self.__session.close()
+
+    def __load_capabilities(self):
+        """
+        Henter og parser GetCapabilities, eller genbruger et tidligere svar for samme url og parametre.
+
+        Parsede svar gemmes på klassen, så flere WFS objekter mod samme tjeneste deler dem. 
+        Er cache_dir angivet, gemmes de også som JSON på disken og kan genbruges på tværs af 
+        processer. Et gemt svar bruges direkte i _CAPABILITIES_MAX_AGE sekunder; derefter 
+        spørges tjenesten igen med If-None-Match/If-Modified-Since, og ved 304 genbruges svaret.
+
+        Kun svar med status 200 gemmes; fejlsvar og ExceptionReports giver en fejl i stedet.
+
+        Returnerer:
+            dict: Operationerne fra GetCapabilities (se __parse_capabilities)
+
+        Raises:
+            requests.RequestException: Hvis tjenesten svarer med en fejlstatus
+            ValueError: Hvis tjenesten svarer med en ExceptionReport
+        """
+        key = (self.url, tuple(sorted((k, str(v)) for k, v in self.__params.items())))
+        with WFS.__capabilities_lock:
+            cached = WFS.__capabilities_cache.get(key)
+        if cached is None and self.__cache_dir is not None:
+            cached = self.__read_cache_file(key)
+            if cached is not None:
+                with WFS.__capabilities_lock:
+                    WFS.__capabilities_cache.setdefault(key, cached)
+
+        headers = {}
+        if cached is not None:
+            if time.time() - cached['time'] < _CAPABILITIES_MAX_AGE:
+                if self.__debug: print('GetCapabilities from cache')
+                return self.__use_capabilities(cached)
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        if self.__debug: print('GetCapabilities url:', self.__prepared_url(self.__params))
+        response = self.__session.get(self.url, params=self.__params, headers=headers, stream=True, timeout=_TIMEOUT)
+        if self.__debug: 
+            print('GetCapabilities response:', response)
+
+        if cached is not None and response.status_code == 304:
+            response.close()
+            cached['time'] = time.time()
+            operations = self.__use_capabilities(cached)
+        else:
+            ## fejlsvar må ikke parses og caches, ellers deler alle senere objekter for samme url et tomt svar
+            response.raise_for_status()
+            ## find operations, feature types and bounding boxes in one streaming pass over the response
+            response.raw.decode_content = True
+            operations = self.__parse_capabilities(response.raw)
+            if response.status_code != 200:
+                return operations
+            cached = {
+                'time': time.time(),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'operations': copy.deepcopy(operations),
+                'feature_list': self.__feature_list,
+                'feature_bboxes': self.__feature_bboxes,
+                'count_default': self.__count_default,
+            }
+        with WFS.__capabilities_lock:
+            WFS.__capabilities_cache[key] = cached
+        ## kun svar der har bestået statustjekket (200, eller 304 mod et gyldigt svar) når hertil og gemmes på disken
+        if self.__cache_dir is not None:
+            self.__write_cache_file(key, cached)
+        return operations
+
+    def __cache_file(self, key):
+        """Returnerer stien til cachefilen for en url og dens parametre; navnet er en hash, så adgangskoder ikke står i filnavnet."""
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.__cache_dir, f'wfs_capabilities_{digest}.json')
+
+    def __read_cache_file(self, key):
+        """Læser et gemt GetCapabilities svar fra disken, eller returnerer None hvis det ikke findes eller ikke kan læses."""
+        try:
+            with open(self.__cache_file(key), encoding='utf-8') as f:
+                cached = json.load(f)
+            ## filer fra før statustjekket kan indeholde et fejlsvar uden operationer; de bruges ikke
+            if not cached['operations']:
+                raise ValueError('cached GetCapabilities has no operations')
+            cached['feature_list'] = [tuple(item) for item in cached['feature_list']]
+            cached['feature_bboxes'] = {name: tuple(corners) for name, corners in cached['feature_bboxes'].items()}
+            return cached
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if self.__debug: print(f'No cached GetCapabilities: {e}')
+            return None
+
+    def __write_cache_file(self, key, cached):
+        """Gemmer et GetCapabilities svar på disken; fejl ignoreres, da cachen kun er en genvej."""
+        try:
+            os.makedirs(self.__cache_dir, exist_ok=True)
+            path = self.__cache_file(key)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(cached, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if self.__debug: print(f'Could not write GetCapabilities cache: {e}')
+
+    def __use_capabilities(self, cached):
+        """Sætter de parsede GetCapabilities-oplysninger fra cachen på objektet og returnerer en kopi af operationerne."""
+        self.__feature_list = cached['feature_list']
+        self.__feature_bboxes = cached['feature_bboxes']
+        self.__count_default = cached['count_default']
+        return copy.deepcopy(cached['operations'])
+
+    def __prepared_url(self, params):
+        """
+        Danner den fulde URL for en forespørgsel. Bruges kun til debug output.
+        """
+        return requests.Request('GET', self.url, params=params).prepare().url
+
     def __get_bbox(self, typename):
         """
         Finder bounding box for et feature type fra WFS-tjenestens GetCapabilities respons.
         
-        Metoden søger efter bounding box koordinater i GetCapabilities XML'en for det 
-        angivne feature type. Hvis bounding box ikke kan findes, eller der opstår 
+        Bounding boxen slås op i de værdier, der blev samlet, da GetCapabilities responsen 
+        blev gennemløbet. Hvis bounding box ikke kan findes, eller der opstår 
         en fejl, kastes en ValueError.
         
         Parametre:
-            typename (str): Navnet på feature typen
+            typename (str): Navnet eller titlen på feature typen
             
         Returnerer:
             list: Liste med fire koordinater [minx, miny, maxx, maxy]
@@ -171,29 +446,17 @@ class WFS:
             ValueError: Hvis bounding box ikke kan findes eller hvis der opstår fejl
         """
         try:
-            feature_item = self.__get_capabilities_root.find(f'.//{{*}}FeatureType[{{*}}Title="{typename}"]', namespaces=self.__get_capabilities_root.nsmap)
-            if feature_item is not None:
-                try:
-                    xMin = feature_item.find('.//{*}LowerCorner').text.split(' ')[0]
-                    yMin = feature_item.find('.//{*}LowerCorner').text.split(' ')[1]
-                    xMax = feature_item.find('.//{*}UpperCorner').text.split(' ')[0]
-                    yMax = feature_item.find('.//{*}UpperCorner').text.split(' ')[1]
-                except:
-                    xMin = feature_item.find('.//{{*}}LatLongBoundingBox', namespaces=self.__get_capabilities_root.nsmap).attrib['minx']
-                    yMin = feature_item.find('.//{{*}}LatLongBoundingBox', namespaces=self.__get_capabilities_root.nsmap).attrib['miny']
-                    xMax = feature_item.find('.//{{*}}LatLongBoundingBox', namespaces=self.__get_capabilities_root.nsmap).attrib['maxx']
-                    yMax = feature_item.find('.//{{*}}LatLongBoundingBox', namespaces=self.__get_capabilities_root.nsmap).attrib['maxy']
+            corners = self.__feature_bboxes.get(typename)
+            if corners is not None:
+                xMin, yMin, xMax, yMax = corners
 
                 if any(coord is None for coord in [xMax, yMax, xMin, yMin]):
                     raise ValueError('Could not find bounding box in GetCapabilities response, please provide bbox as a parameter')
 
-                gdf_bbox = box(xMin, yMin, xMax, yMax)
-
-                # Opretter en GeoDataFrame med bounding box polygonen
-                gdf = gpd.GeoDataFrame({'geometry': [gdf_bbox]})
-                gdf.crs = "EPSG:4326"
-                gdf = gdf.to_crs("EPSG:25832")
-                self.__default_bbox = [str(xy) for xy in list(gdf.geometry[0].bounds)]
+                # Transformerer bounding boxen direkte fra EPSG:4326 til EPSG:25832; transform_bounds tager også kanterne med
+                bounds = _TRANSFORMER_4326_TO_25832.transform_bounds(xMin, yMin, xMax, yMax)
+                self.__default_bbox = [str(coord) for coord in bounds]
+                self.__clip_bounds = tuple(bounds)
                 return self.__default_bbox
             else:
                 raise ValueError('Could not find bounding box in GetCapabilities response, please provide bbox as a parameter')
@@ -201,17 +464,20 @@ class WFS:
             if self.__debug: print(e)
             raise ValueError('Could not find bounding box in GetCapabilities response', e)
 
-    def __get_operation_names(self):
+    def __parse_capabilities(self, source):
         """
-        Henter tilgængelige WFS operationer fra GetCapabilities responsen.
+        Gennemløber GetCapabilities responsen én gang og samler alt, der skal bruges senere.
         
-        Metoden parser GetCapabilities responsen og udtrækker alle operationer og deres 
-        parametre. For hver operation gemmes de tilgængelige parameterværdier.
+        Responsen parses løbende med iterparse, og de behandlede elementer ryddes væk 
+        undervejs, så hele dokumentet ikke skal ligge i hukommelsen.
         
-        Returnerer:
-            dict: Dictionary med operationer som nøgler og deres parametre som værdier
-            
-        Eksempel på returværdi:
+        I samme gennemløb findes:
+            - operationerne og deres parametre (self.operations)
+            - CountDefault, der bruges som MaxFeatures
+            - navn og titel for hver feature type
+            - bounding box for hver feature type, slået op på både titel og navn
+        
+        Eksempel på self.operations:
             {
             'GetCapabilities': {
                 'AcceptVersions': ['2.0.0', '1.1.0', '1.0.0'],
@@ -225,23 +491,71 @@ class WFS:
             }
         """
         operation_names = {}
-        operation_elements = self.__get_capabilities_root.findall(f'.//{{*}}Operation', namespaces=self.__get_capabilities_root.nsmap)
-        for element in operation_elements:
-            try:
-                operation_name  = element.attrib['name']
-                if self.__debug: print(f'Getting operation: {operation_name}')
-                parameters = {}
-                for child in element:
-                    vals = []
-                    if f'Parameter' in child.tag:
-                        param_name = child.attrib['name']
-                        for val in child:
-                            vals = [v.text for v in val]
-                        parameters[param_name] = vals
-                operation_names[operation_name] = parameters
-            except Exception as e:
-                if self.__debug: print(e)
-                pass
+        feature_list = []
+        feature_bboxes = {}
+        count_default = None
+        context = etree.iterparse(source, events=('end',), tag=('{*}Operation', '{*}FeatureType', '{*}Constraint'), **_PARSER_OPTIONS)
+        for _, element in context:
+            tag = etree.QName(element).localname
+            if tag == 'Operation':
+                try:
+                    operation_name = element.attrib['name']
+                    if self.__debug: print(f'Getting operation: {operation_name}')
+                    parameters = {}
+                    ## Value ligger under AllowedValues i WFS 2.0 og direkte under Parameter i WFS 1.1; begge findes i ét tag-filtreret gennemløb
+                    for child in element.iterchildren('{*}Parameter'):
+                        parameters[child.attrib['name']] = [v.text for v in child.iter('{*}Value')]
+                    operation_names[operation_name] = parameters
+                except Exception as e:
+                    if self.__debug: print(e)
+                    pass
+            elif tag == 'FeatureType':
+                ## underelementerne gennemløbes én gang, og løkken stopper når navn, titel og bbox er fundet
+                found = {}
+                for child in element.iter(_FEATURE_TYPE_TAGS):
+                    child_tag = etree.QName(child).localname
+                    if child_tag not in found:
+                        found[child_tag] = child
+                        if 'Name' in found and 'Title' in found and ('LatLongBoundingBox' in found or ('LowerCorner' in found and 'UpperCorner' in found)):
+                            break
+                if 'Name' not in found or found['Name'].text is None:
+                    continue
+                feature_name = found['Name'].text.split(':')[-1]
+                feature_title = found['Title'].text if 'Title' in found else None
+                feature_list.append((feature_name, feature_title))
+                try:
+                    if 'LowerCorner' in found and 'UpperCorner' in found:
+                        lower = found['LowerCorner'].text.split()
+                        upper = found['UpperCorner'].text.split()
+                        xMin, yMin = float(lower[0]), float(lower[1])
+                        xMax, yMax = float(upper[0]), float(upper[1])
+                    else:
+                        attrib = found['LatLongBoundingBox'].attrib
+                        xMin, yMin, xMax, yMax = float(attrib['minx']), float(attrib['miny']), float(attrib['maxx']), float(attrib['maxy'])
+                    corners = (xMin, yMin, xMax, yMax)
+                    feature_bboxes[feature_name] = corners
+                    if feature_title is not None:
+                        feature_bboxes[feature_title] = corners
+                except Exception as e:
+                    if self.__debug: print(f'No bounding box for {feature_name}: {e}')
+            elif tag == 'Constraint' and count_default is None and element.get('name') == 'CountDefault':
+                default_value = next(element.iter('{*}DefaultValue'), None)
+                if default_value is not None:
+                    count_default = default_value.text
+
+            ## færdigbehandlede operationer og feature typer fjernes fra træet igen
+            if tag != 'Constraint':
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+        ## fejl fra tjenesten kommer som en ExceptionReport med status 200 og må ikke blive til tomme operationer
+        if etree.QName(context.root).localname in ('ExceptionReport', 'ServiceExceptionReport'):
+            raise ValueError(f'WFS returned an exception: {self.__exception_text(etree.tostring(context.root))}')
+
+        self.__feature_list = feature_list
+        self.__feature_bboxes = feature_bboxes
+        self.__count_default = count_default
         return operation_names
         
     def __get_maxfeatures(self):
@@ -250,13 +564,8 @@ class WFS:
         """
         if self.__debug: print('Getting maxfeatures')
         try:
-            constraint = self.__get_capabilities_root.find('.//{*}Constraint[@name="CountDefault"]', namespaces=self.__get_capabilities_root.nsmap)
-            if constraint is not None:
-                default_value = constraint.find('.//{*}DefaultValue', namespaces=self.__get_capabilities_root.nsmap)
-                if default_value is not None:
-                    self.operations['MaxFeatures'] = int(default_value.text)
-                else:
-                    self.operations['MaxFeatures'] = 10000
+            if self.__count_default is not None:
+                self.operations['MaxFeatures'] = int(self.__count_default)
             else:
                 self.operations['MaxFeatures'] = 10000
         except Exception as e:
@@ -267,28 +576,21 @@ class WFS:
         """
         Henter en liste over tilgængelige feature typer fra WFS-tjenesten.
         
-        Metoden parser GetCapabilities responsen og udtrækker navnene på alle 
-        tilgængelige feature typer samt deres titler. Der oprettes en 
+        Metoden bruger navnene og titlerne på de feature typer, der blev fundet 
+        i GetCapabilities responsen. Der oprettes en 
         oversættelsestabel mellem titler og tekniske navne.
         
         Returnerer:
-            list: Liste over feature type titler
+            dict: Feature typer og antal features; med get_init_count hentes antallet først ved opslag
 
         """
         feature_types = {}
         feature_translations = {}
-        feature_type_elements = self.__get_capabilities_root.findall(f'.//{{*}}FeatureType', namespaces=self.__get_capabilities_root.nsmap)
-        for element in feature_type_elements:
+        for feature_name, feature_title in self.__feature_list:
             try:
-                feature_name = element.find(f'.//{{*}}Name', namespaces=self.__get_capabilities_root.nsmap).text
-                feature_name = feature_name.split(':')[-1]
-                feature_title = element.find(f'.//{{*}}Title', namespaces=self.__get_capabilities_root.nsmap).text
                 if self.__debug: print(f'Feature name: {feature_name}, Feature title: {feature_title}')
 
-                if self.__get_init_count == True:
-                    feature_types[feature_name] = self.__get_hits(feature_name, self.__default_bbox, initial_hits=True)
-                else:
-                    feature_types[feature_name] = 0
+                feature_types[feature_name] = 0
 
                 if feature_title is not None:
                     feature_translations[feature_title] = feature_name
@@ -298,36 +600,41 @@ class WFS:
                 if self.__debug: print(e)
                 pass
         self.__feature_translations = feature_translations
+        if self.__get_init_count == True:
+            ## antallet hentes først når en feature type slås op, ikke for alle lag ved oprettelsen
+            return _LazyCounts(weakref.WeakMethod(self.__count_hits), feature_types, self.__max_workers)
         return feature_types
+
+    def __count_hits(self, feature_name):
+        """Henter antal features for en feature type i default bbox'en; bruges af _LazyCounts."""
+        try:
+            return self.__get_hits(feature_name, self.__default_bbox, initial_hits=True)
+        except Exception as e:
+            if self.__debug: print(e)
+            return 0
     
 
-    def __split_bbox(self, bbox):
+    def __split_bbox(self, bbox, hits):
         """
-        Opdeler en bounding box i to mindre bounding boxes.
+        Opdeler en bounding box i et gitter af mindre bounding boxes.
         
-        Funktionen tager en bounding box og opdeler den i to mindre bounding boxes
-        langs den længste side. De nye bounding boxes tilføjes til self.bboxes.
+        Antallet af felter beregnes ud fra antallet af hits, så hvert felt i gennemsnit 
+        har under maxfeatures features: n = ceil(sqrt(hits / maxfeatures)), og bboxen 
+        opdeles i n x n lige store felter. Er det forventede antal pr. felt (hits / n²) 
+        under 80% af maxfeatures, hentes felterne direkte; ellers spørges der først om 
+        hits. Felter der stadig har for mange features opdeles igen.
         
         Parametre:
-            bbox (list): Liste med fire koordinater [minx, miny, maxx, maxy]
+            bbox (tuple): Fire koordinater (minx, miny, maxx, maxy) som floats
+            hits (int): Antal features i bboxen
             
-        Tilføjer:
-            De to nye bounding boxes til self.bboxes listen
+        Returnerer:
+            list: Liste med de nye bounding boxes som tupler af floats
         """
-        minx = float(bbox[0])
-        miny = float(bbox[1])
-        maxx = float(bbox[2])
-        maxy = float(bbox[3])
-
-        if (maxx - minx) < (maxy - miny):
-            bb1 = [str(minx), str(miny), str(maxx), str(miny + ((maxy - miny) / 2))]
-            bb2 = [str(minx), str(miny + ((maxy - miny) / 2)), str(maxx), str(maxy)]
-            return [bb1, bb2]
-        else:
-            bb1 = [str(minx), str(miny), str(minx + ((maxx - minx) / 2)), str(maxy)]
-            bb2 = [str(minx + ((maxx - minx) / 2)), str(miny), str(maxx), str(maxy)]
-            return [bb1, bb2]
-        
+        n = max(2, math.ceil(math.sqrt(hits / self.maxfeatures)))
+        xs = np.linspace(bbox[0], bbox[2], n + 1).tolist()
+        ys = np.linspace(bbox[1], bbox[3], n + 1).tolist()
+        return [(xs[i], ys[j], xs[i + 1], ys[j + 1]) for i in range(n) for j in range(n)]
     
     def __get_hits(self, feature_name, bbox, initial_hits=False):
         """
@@ -346,34 +653,46 @@ class WFS:
         Raises:
             ValueError: Hvis antallet af features ikke kan læses fra WFS-responsen
         """
+        ## params dannes som en ny dict for hvert kald ligesom i __get_features_gdf, så hits spørges med de samme ekstra parametre
         params = {
-            'version': self.version,
-            'resulttype': 'hits',
+            **self.__params,
             'service': 'WFS',
             'request': 'GetFeature',
-            'username': self.username,
-            'password': self.password,
+            'version': self.version,
+            'resulttype': 'hits',
         }
-        if not initial_hits:
-            params['bbox'] = ','.join(bbox)
-        elif initial_hits and self.__missing_default_bbox is False:
-            params['bbox'] = ','.join(self.__default_bbox)
+        if initial_hits:
+            bbox = self.__default_bbox if self.__missing_default_bbox is False else None
+        if bbox is not None:
+            bbox = tuple(map(float, bbox))
+            params['bbox'] = _bbox_param(bbox)
 
         if self.version in ('1.0.0', '1.1.0'):
             params['typeName'] = feature_name
         else:
             params['typeNames'] = feature_name
+
+        ## antallet huskes pr. (feature_name, bbox), så samme bbox ikke spørges to gange
+        key = (feature_name, bbox)
+        with self.__hits_lock:
+            if key in self.__hits_cache:
+                self.__hits_cache.move_to_end(key)
+                return self.__hits_cache[key]
         
         try:
-            wfs_url = requests.Request('GET', self.url, params=params).prepare().url
-            if self.__debug: print('hits url: ', wfs_url)
-            response = requests.get(wfs_url)
-            root = etree.XML(response.content)
+            if self.__debug: print('hits url: ', self.__prepared_url(params))
+            response = self.__session.get(self.url, params=params, timeout=_TIMEOUT)
+            ## kun rodelementets attributter skal bruges, så parsningen stopper ved første start-tag
+            _, root = next(etree.iterparse(io.BytesIO(response.content), events=('start',)))
             hits = int(root.attrib['numberMatched'])
-            return hits
         except:
             tmp_gdf = self.__get_features_gdf(feature_name, bbox)
-            return len(tmp_gdf)
+            hits = len(tmp_gdf)
+        with self.__hits_lock:
+            self.__hits_cache[key] = hits
+            if len(self.__hits_cache) > _HITS_CACHE_SIZE:
+                self.__hits_cache.popitem(last=False)
+        return hits
     
 
     def __get_features_gdf(self, feature_name, bbox, count= None):
@@ -383,9 +702,14 @@ class WFS:
         Funktionen danner en WFS GetFeature forespørgsel med de angivne parametre og 
         returnerer resultatet som en GeoDataFrame.
         
+        Svaret (typisk GeoJSON) parses af GDAL direkte fra hukommelsen, med pyogrio og 
+        Arrow når de er installeret. Både JSON, geometrier og kolonner håndteres dermed i C, 
+        så der er ingen grund til at parse JSON i Python og bygge geometrierne bagefter.
+        
         Parametre:
             feature_name (str): Navnet på det ønskede feature lag
             bbox (list): Bounding box koordinater [minx, miny, maxx, maxy]
+            count (int): Maks antal features der hentes (valgfri)
             
         Returnerer:
             GeoDataFrame: GeoDataFrame med de hentede features
@@ -393,12 +717,15 @@ class WFS:
         Raises:
             ValueError: Hvis GeoDataFrame ikke kan læses fra WFS-responsen
         """
-        params = self.__params
-        params['version'] = self.version
-        params['bbox'] = ','.join(bbox)
-        params['resulttype'] = 'results'
-        params['service'] = 'WFS'
-        params['request'] = 'GetFeature'
+        ## params dannes som en ny dict for hvert kald, så self.__params ikke ændres
+        params = {
+            **self.__params,
+            'service': 'WFS',
+            'request': 'GetFeature',
+            'version': self.version,
+            'bbox': _bbox_param(bbox),
+            'resulttype': 'results',
+        }
         if self.version in ('1.0.0', '1.1.0'):
             params['typeName'] = feature_name
             if count is not None:
@@ -407,45 +734,80 @@ class WFS:
             params['typeNames'] = feature_name
             if count is not None:
                 params['count'] = count
-        if hasattr(self, 'outputFormat'):
+        if self.outputFormat is not None:
             params['outputFormat'] = self.outputFormat
-        wfs_url = requests.Request('GET', self.url, params=params).prepare().url
-        if self.__debug: print('___get_features_gdf', wfs_url)
+        if self.__debug: print('___get_features_gdf', self.__prepared_url(params))
         try:
-            return gpd.read_file(wfs_url, crs="EPSG:25832")
-        except:
-            # return gpd.read_file(wfs_url)
-            raise ValueError('Could not read GeoDataFrame from WFS response')
+            ## svaret hentes via sessionen og læses fra hukommelsen, så GDAL ikke henter URL'en igen
+            response = self.__session.get(self.url, params=params, timeout=_FEATURE_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise ValueError('Could not read GeoDataFrame from WFS response', e)
+        content = response.content
+        ## fejl fra tjenesten kommer som en ExceptionReport med status 200; teksten bruges i fejlen i stedet for en GDAL-parsefejl
+        if b'ExceptionReport' in content[:1024]:
+            raise ValueError(f'WFS returned an exception: {self.__exception_text(content)}')
+        try:
+            if _READ_ENGINE:
+                ## pyogrio læser bytes direkte; geopandas' engine-opslag og BytesIO-indpakningen springes over
+                return pyogrio.read_dataframe(content, use_arrow=_READ_ENGINE.get('use_arrow', False))
+            return gpd.read_file(io.BytesIO(content))
+        except Exception as e:
+            raise ValueError('Could not read GeoDataFrame from WFS response', e)
+
+    def __exception_text(self, content):
+        """Finder fejlteksten i en OWS ExceptionReport eller en ServiceExceptionReport."""
+        try:
+            root = etree.XML(content)
+            texts = [e.text.strip() for e in root.iter('{*}ExceptionText', '{*}ServiceException') if e.text and e.text.strip()]
+            return '; '.join(texts) if texts else content[:500].decode('utf-8', 'replace')
+        except etree.XMLSyntaxError:
+            return content[:500].decode('utf-8', 'replace')
 
 
     def __clip_gdf(self, tmp_gdf):
         """
         Klipper en GeoDataFrame til bounding box defineret i WFS-objektet.
         
+        Geometrier hvis bounds ligger inden for bbox'en er dækket af den og beholdes uændret; 
+        for et akse-parallelt rektangel svarer det til covered_by, men kræver kun én vektoriseret 
+        bounds-beregning. Kun de øvrige geometrier klippes med shapely.clip_by_rect, og 
+        geometrier der bliver tomme fjernes.
+        
         Parametre:
-            gdf (GeoDataFrame): GeoDataFrame der skal klippes
+            tmp_gdf (GeoDataFrame): GeoDataFrame der skal klippes
             
         Returnerer:
             GeoDataFrame: Klippet GeoDataFrame
         """
-        # tmp_gdf = gdf.copy()
-        # tmp_gdf.crs = "EPSG:4326"
-        # tmp_gdf = tmp_gdf.to_crs("EPSG:25832")
-        gdf_bbox = box(float(self.__default_bbox[0]), float(self.__default_bbox[1]), float(self.__default_bbox[2]), float(self.__default_bbox[3]))
-        gdf_bbox = gpd.GeoDataFrame({'geometry': [gdf_bbox]})
-        gdf_bbox.crs = "EPSG:25832"
+        xmin, ymin, xmax, ymax = self.__clip_bounds
         try:
-            tmp_gdf.set_crs("EPSG:25832", inplace=True)
-            tmp_gdf = tmp_gdf.to_crs("EPSG:25832")
+            ## data uden CRS antages at være i EPSG:25832, og data der allerede er i EPSG:25832 projiceres ikke igen
+            if tmp_gdf.crs is None:
+                tmp_gdf.set_crs(_CRS_25832, inplace=True)
+            elif tmp_gdf.crs.to_epsg() != 25832:
+                tmp_gdf = tmp_gdf.to_crs(_CRS_25832)
         except Exception as e:
             if self.__debug: print(e)
             pass
         if self.__debug:
             print('Clipping GeoDataFrame to bounding box')
-            print(float(self.__default_bbox[0]), float(self.__default_bbox[1]), float(self.__default_bbox[2]), float(self.__default_bbox[3]))
+            print(xmin, ymin, xmax, ymax)
             print(tmp_gdf.crs)
-            print(gdf_bbox.crs)
-        gdf = gpd.clip(tmp_gdf, gdf_bbox)
+        ## geometrier der ligger helt inden for bbox'en skal ikke klippes, de findes ud fra deres bounds
+        geometries = tmp_gdf.geometry.to_numpy()
+        bounds = shapely.bounds(geometries)
+        inside = (bounds[:, 0] >= xmin) & (bounds[:, 1] >= ymin) & (bounds[:, 2] <= xmax) & (bounds[:, 3] <= ymax)
+        if inside.all():
+            return tmp_gdf
+        ## bbox'en er akse-parallel, så GEOS' rektangel-klipning bruges på resten af geometrierne på én gang
+        clipped = shapely.clip_by_rect(geometries[~inside], xmin, ymin, xmax, ymax)
+        geometries[~inside] = clipped
+        tmp_gdf[tmp_gdf.geometry.name] = geometries
+        ## kun de klippede geometrier kan være blevet tomme
+        keep = inside.copy()
+        keep[~inside] = ~shapely.is_empty(clipped)
+        gdf = tmp_gdf[keep]
         return gdf
 
     def __descripe_feature(self, feature_name):
@@ -464,23 +826,28 @@ class WFS:
         Raises:
             ValueError: Hvis GeoDataFrame ikke kan læses fra WFS-responsen
         """
-        params = self.__params
-        params['request'] = 'DescribeFeatureType'
-        params['version'] = self.version
-        params['typename'] = feature_name
-        wfs_url = requests.Request('GET', self.url, params=params).prepare().url
+        ## skemaet ændrer sig ikke i objektets levetid, så det hentes kun én gang pr. feature type og version
+        key = (feature_name, self.version)
+        if key in self.__describe_cache:
+            return self.__describe_cache[key]
+
+        params = {
+            **self.__params,
+            'request': 'DescribeFeatureType',
+            'version': self.version,
+            'typename': feature_name,
+        }
         if self.__debug: 
             print('Getting DescribeFeatureType')
-            print(wfs_url)
+            print(self.__prepared_url(params))
 
-        response = requests.get(wfs_url)
-        root = etree.XML(response.content)
-        ns = root.nsmap
+        response = self.__session.get(self.url, params=params, timeout=_TIMEOUT)
+        root = etree.fromstring(response.content, parser=_XML_PARSER)
         ints = []
         decimals = []
         datetimes = []
         fc_schema = []
-        for e in root.findall(f'.//{{*}}complexContent//{{*}}element', namespaces=ns):
+        for e in _XP_SCHEMA_ELEMENTS(root):
             e = e.attrib
             dtype = e['type']
             # if self.__debug: print(f'Element: {e} - Type: {dtype}')
@@ -493,18 +860,50 @@ class WFS:
             else:
                 fc_schema.append(e['name'])
         # if self.__debug: print(f'ints: {ints} - decimals: {decimals} - datetimes: {datetimes} - fc_schema: {fc_schema}')
-        return {'ints':ints, 'decimals':decimals, 'datetimes':datetimes, 'fc_schema':fc_schema}
+        desc = {'ints':ints, 'decimals':decimals, 'datetimes':datetimes, 'fc_schema':fc_schema}
+        self.__describe_cache[key] = desc
+        return desc
+
+
+    def __to_datetime(self, series):
+        """
+        Konverterer en kolonne med ISO 8601 datoer til datetime uden tidszone.
 
+        Kolonnen parses i ét vektoriseret kald. Tidszonen fjernes, så den lokale tid bevares 
+        (2020-06-14T11:18:45.344+02:00 bliver 2020-06-14 11:18:45.344). Har kolonnen blandede 
+        tidszoner, fjernes offset fra teksten før parsningen. Værdier der ikke kan parses bliver NaT.
+
+        Parametre:
+            series (Series): Kolonnen der skal konverteres
+
+        Returnerer:
+            Series: Kolonnen som datetime64 uden tidszone
+        """
+        try:
+            converted = pd.to_datetime(series, format='ISO8601', errors='coerce')
+        except ValueError:
+            converted = None
+        if converted is not None and isinstance(converted.dtype, pd.DatetimeTZDtype):
+            return converted.dt.tz_localize(None)
+        if converted is not None and pd.api.types.is_datetime64_dtype(converted.dtype):
+            return converted
+        ## blandede tidszoner; offset fjernes så den lokale tid bruges
+        naive = series.astype(str).str.replace(r'(Z|[+-]\d{2}:?\d{2})$', '', regex=True)
+        return pd.to_datetime(naive, format='ISO8601', errors='coerce')
 
-    def get_feature(self, feature_name, **kwargs):
+    def get_feature(self, feature_name, *, clip_gdf=True, count=None):
         """
         Henter features fra WFS-tjenesten som en GeoDataFrame.
         
+        Uden count hentes data gennem en arbejdskø på en trådpulje: der spørges om hits 
+        for hver bbox, bboxe med for mange hits opdeles og sættes i kø igen, og resten 
+        hentes, så snart deres antal kendes. Opdelingen er dermed ikke bundet til niveauer, 
+        og alle felter på tværs af niveauer hentes samtidigt.
+        
         Parametre:
             feature_name (str): Navnet på det ønskede feature lag
-            **kwargs: Valgfri nøgleordsargumenter
             clip_gdf (bool): Hvis True, klippes GeoDataFrame til bounding box (standard: True)
-            count (int): Antal features der skal hentes (standard: maxfeatures)
+            count (int): Antal features der skal hentes (standard: maxfeatures); over maxfeatures begrænses det til antallet i bboxen
             
         Returnerer:
             GeoDataFrame: Pandas GeoDataFrame med de hentede features
@@ -514,89 +913,115 @@ class WFS:
             >>> gdf = wfs.get_feature('kommuner')
         """
 
-        for key, value in kwargs.items():
-            setattr(self, key, value)
-            # print(self, key, value)
-        
-        ## check if count is set
-        if hasattr(self, 'count'):
-            count = self.count
-        else:
-            count = None
-
-        ## check if clip_gdf is set
-        if hasattr(self, 'clip_gdf'):
-            clip_gdf = self.clip_gdf
-        else:
-            clip_gdf = True
-
         if self.bboxes is None:
             self.bboxes = [self.__get_bbox(feature_name)]
         if self.__debug: print(f'Bounding boxes: {self.bboxes}')
         # feature_name = self.__feature_translations[feature_name]
         gdfs = []
-        bboxes = self.bboxes.copy()
+        ## internt holdes bboxene som tupler af floats; de laves kun til tekst når forespørgslen dannes
+        bboxes = [tuple(map(float, bbox)) for bbox in self.bboxes]
         if count is not None:
+            ## et count over maxfeatures kan være langt større end laget; antallet spørges først, så count ikke overstiger det
+            if count > self.maxfeatures and 'hits' in self.operations.get('GetFeature', {}).get('resultType', []):
+                count = min(count, max(self.__get_hits(feature_name, bboxes[0]), 1))
             gdf = self.__get_features_gdf(feature_name, bboxes[0], count)
         else:
-            for bbox in bboxes:
-                hits = self.__get_hits(feature_name, bbox)
-                if hits > self.maxfeatures:
-                    if self.__debug:
-                        print(f'Number of hits {hits} exceeds maxfeatures {self.maxfeatures}. Splitting bbox')
-                    for bb in self.__split_bbox(bbox):
-                        bboxes.append(bb)
-                else:
-                    gdf = self.__get_features_gdf(feature_name, bbox)
-                    gdfs.append(gdf)
+            ## hits og download af de enkelte bboxe køres samtidigt; bboxe med for mange hits opdeles og sættes i kø igen
+            seen_ids = set()
+            has_ids = True
+            ## snitlinjerne fra opdelingen; med flere start-bboxe kan de overlappe, og så tjekkes alle rækker for dubletter
+            cut_lines = [] if len(bboxes) == 1 else None
+            with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+                pending = {executor.submit(self.__get_hits, feature_name, bbox): ('hits', bbox) for bbox in bboxes}
+                ## data for de oprindelige bboxe hentes samtidig med hits, så det almindelige tilfælde under maxfeatures kun koster én rundtur;
+                ## count begrænser downloaden, så et lag over maxfeatures ikke hentes helt for at blive smidt væk
+                spec_count = int(self.maxfeatures) + 1
+                speculative = {bbox: executor.submit(self.__get_features_gdf, feature_name, bbox, spec_count) for bbox in bboxes}
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        kind, bbox = pending.pop(future)
+                        if kind in ('hits', 'split_hits'):
+                            hits = future.result()
+                            spec = speculative.pop(bbox, None) if kind == 'hits' else None
+                            if spec is not None and hits <= self.maxfeatures:
+                                pending[spec] = ('features', bbox)
+                                continue
+                            if spec is not None:
+                                ## for mange hits; den spekulative download bruges ikke
+                                spec.cancel()
+                            if hits > self.maxfeatures:
+                                if self.__debug:
+                                    print(f'Number of hits {hits} exceeds maxfeatures {self.maxfeatures}. Splitting bbox')
+                                children = self.__split_bbox(bbox, hits)
+                                if cut_lines is not None:
+                                    cut_lines.extend(((x, bbox[1]), (x, bbox[3])) for x in sorted({c[0] for c in children})[1:])
+                                    cut_lines.extend(((bbox[0], y), (bbox[2], y)) for y in sorted({c[1] for c in children})[1:])
+                                ## når det forventede antal pr. felt ligger godt under maxfeatures, hentes felterne direkte uden hits
+                                skip_hits = hits / len(children) <= _SKIP_HITS_RATIO * self.maxfeatures
+                                for bb in children:
+                                    if skip_hits:
+                                        pending[executor.submit(self.__get_features_gdf, feature_name, bb)] = ('estimated', bb)
+                                    else:
+                                        pending[executor.submit(self.__get_hits, feature_name, bb)] = ('split_hits', bb)
+                            elif hits == 0 and kind == 'split_hits':
+                                ## tomme delbboxe hentes ikke; mindst én delbbox har features, så resultatet får stadig et skema
+                                continue
+                            else:
+                                pending[executor.submit(self.__get_features_gdf, feature_name, bbox)] = ('features', bbox)
+                        elif kind == 'estimated' and len(future.result()) >= self.maxfeatures:
+                            ## felt hentet uden hits ramte grænsen og kan være afkortet; antallet hentes så feltet kan opdeles
+                            pending[executor.submit(self.__get_hits, feature_name, bbox)] = ('split_hits', bbox)
+                        else:
+                            tile = future.result()
+                            ## har svaret et feature id, fjernes dubletter fra overlappende bboxe allerede når felterne modtages
+                            id_column = next((col for col in _ID_COLUMNS if col in tile.columns), None)
+                            if id_column is not None:
+                                ids = tile[id_column]
+                                keep = ~(ids.isin(seen_ids) | ids.duplicated())
+                                seen_ids.update(ids[keep])
+                                tile = tile[keep.to_numpy()]
+                            else:
+                                has_ids = False
+                            gdfs.append(tile)
 
-            self.gdfs = gdfs
-            gdf = pd.concat(gdfs, ignore_index=True)        
-            gdf.drop_duplicates(inplace=True)
-        for col in gdf.columns.to_list():
-            if '.' in col:
-                gdf.rename(columns={col: col.replace('.', '_')}, inplace=True)
+            ## dubletter kan kun opstå mellem felter, så med ét felt (ingen opdeling) springes tjekket over
+            needs_dedup = not has_ids and len(gdfs) > 1
+            gdf = pd.concat(gdfs, ignore_index=True, **_CONCAT_KWARGS)
+            ## felterne er nu samlet i gdf, så listen slippes med det samme
+            gdfs.clear()
+            if needs_dedup:
+                ## kun features hvis udstrækning rammer en snitlinje kan ligge i flere felter, så kun de tjekkes;
+                ## snitlinjerne er i EPSG:25832, så er svaret i en anden CRS, tjekkes alle rækker
+                if cut_lines and (gdf.crs is None or gdf.crs.to_epsg() == 25832):
+                    border = shapely.MultiLineString(cut_lines)
+                    shapely.prepare(border)
+                    rows = np.flatnonzero(shapely.intersects(shapely.envelope(gdf.geometry.values), border))
+                else:
+                    rows = np.arange(len(gdf))
+                ## uden feature id findes dubletter ud fra attributterne og geometriens WKB i stedet for geometri-objekterne
+                candidates = gdf.iloc[rows]
+                dedup_key = pd.DataFrame(candidates.drop(columns=candidates.geometry.name))
+                dedup_key['_gkey'] = shapely.to_wkb(candidates.geometry.values)
+                keep = np.ones(len(gdf), dtype=bool)
+                keep[rows[dedup_key.duplicated().to_numpy()]] = False
+                gdf = gdf[keep]
+            gdf = gdf.reset_index(drop=True)
 
-        gdf['xTid'] = pd.Timestamp.now()
+        ## tidsstemplet lægges ind som ét færdigt datetime64-array i stedet for at pandas skal udbrede en Timestamp
+        gdf['xTid'] = np.full(len(gdf), np.datetime64(pd.Timestamp.now(), 'ns'), dtype='datetime64[ns]')
 
         if clip_gdf and self.__missing_default_bbox is False and len(gdf) > 0:
             gdf = self.__clip_gdf(gdf)
 
         desc = self.__descripe_feature(feature_name)
         if len(gdf) > 0:
-            for col in gdf.columns.to_list():
-                if col in desc['datetimes']:
-                    try:
-                        gdf[col] = pd.to_datetime(gdf[col]).dt.tz_localize(None)
-                        continue
-                    except:
-                        if self.__debug:
-                            print(f'Could not convert {col} to datetime')
-                            print('trying to convert to datetime with errors=coerce')
-                        try:
-                            gdf[col] = pd.to_datetime(gdf[col], errors='coerce').dt.tz_localize(None)
-                            continue
-                        except:
-                            if self.__debug:
-                                print(f'Could not convert {col} to datetime with errors=coerce')
-                                print('Trying to convert to datetime with fomat 2020-06-14T11:18:45.344+02:00')
-                            try:
-                                gdf[col] = pd.to_datetime(gdf[col], format='%Y-%m-%dT%H:%M:%S.%f%z').dt.tz_localize(None)
-                                continue
-                            except:
-                                if self.__debug:
-                                    print(f'Could not convert {col} to datetime with format 2020-06-14T11:18:45.344+02:00')
-                                    print('trying a last thing')
-                                try:
-                                    ## remove all after + and remove the T
-                                    gdf[col] = pd.to_datetime(gdf[col].str.split('+').str[0].str.replace('T', ' '), errors='coerce')
-                                    continue
-                                except:
-                                    if self.__debug: print(f'Could not convert {col} to datetime with last resort')
-                                    continue
-                        
-                
-                        
-
-        gdf.columns = [col[:30] for col in gdf.columns]
+            for col in [c for c in gdf.columns if c in desc['datetimes']]:
+                try:
+                    gdf[col] = self.__to_datetime(gdf[col])
+                except Exception as e:
+                    if self.__debug: print(f'Could not convert {col} to datetime: {e}')
+
+        ## punktummer erstattes og navnene afkortes i én omdøbning, efter datokolonnerne er fundet ud fra deres oprindelige navne
+        gdf.columns = gdf.columns.str.replace('.', '_', regex=False).str[:30]
         return gdf        
\ No newline at end of file
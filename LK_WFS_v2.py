@@ -17,6 +17,7 @@ Parametre ved initialisering:
     maxfeatures (int, optional): Max antal features per forespørgsel
     outputformat (str, optional): Output format --> Prøv at bruge 'json' hvis den ellers ikke virker
     params (dict, optional): Ekstra parametre til WFS forespørgsler
+    max_workers (int, optional): Maks antal samtidige forespørgsler når data hentes, default 8
 
 Eksempel:
     >>> wfs = WFS('https://example.com/wfs', 
@@ -28,18 +29,60 @@ Eksempel:
     params kan f.eks. være:
     >>> params = {'whoami': 'Lemvig Kommune'}
 
+    Skemaet for flere lag kan hentes i én forespørgsel, inden lagene hentes:
+    >>> wfs.describe_features(['kommuner', 'veje'])
+
 
 Bemærk:
-    Kræver geopandas, pandas, requests, lxml, shapely og fiona installeret
+    Kræver geopandas, pandas, requests, lxml, shapely, pyproj og pyogrio eller fiona installeret
 """
 import pandas as pd
 import geopandas as gpd
-import fiona
-fiona.drvsupport.supported_drivers['WFS'] = 'r'
+import io
+import math
+import re
+import numpy as np
 import requests
-from xml.etree import ElementTree as ET
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import lxml.etree as etree
+import pyproj
+import shapely
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from shapely.geometry import box
+try:
+    import pyogrio
+    _READ_ENGINE = {'engine': 'pyogrio'}
+except ImportError:
+    ## uden pyogrio læser geopandas med fiona
+    _READ_ENGINE = {}
+
+## Transformer genbruges til omregning af lagenes WGS84 bbox
+_TRANSFORMER_4326_TO_25832 = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:25832", always_xy=True)
+
+## timeouts (connect, read) i sekunder; GetFeature kan tage længere tid end metadata-forespørgslerne
+_TIMEOUT = (5, 60)
+_FEATURE_TIMEOUT = (5, 300)
+
+
+## delbboxe hentes uden hits-forespørgsel, når det forventede antal features er under denne andel af maxfeatures
+_SKIP_HITS_RATIO = 0.7
+## XPath til felterne i DescribeFeatureType kompileres én gang med XML Schema namespacet i stedet for at parse '{*}' mønstret ved hvert kald
+_XP_SCHEMA_ELEMENTS = etree.XPath('.//xsd:complexContent//xsd:element', namespaces={'xsd': 'http://www.w3.org/2001/XMLSchema'})
+## kolonner med et unikt feature id; gml_id fra GML-svar og fid fra bl.a. GeoServers JSON, i prioriteret rækkefølge
+_ID_COLUMNS = ('gml_id', 'fid')
+## parametre der sættes pr. forespørgsel og derfor ikke indgår i den færdigkodede basis-URL
+_REQUEST_KEYS = {'request', 'version', 'resulttype', 'bbox', 'typename', 'typenames', 'outputformat'}
+## de elementer i GetCapabilities der læses; resten af dokumentet springes over af parseren
+_CAPABILITIES_TAGS = ('{*}FeatureType', '{*}Operation', '{*}Request', '{*}Constraint')
+## underelementer af FeatureType og nøglerne de gemmes under i feature_list
+_FEATURE_TYPE_KEYS = {'Name': 'name', 'Title': 'title', 'Abstract': 'abstract', 'DefaultCRS': 'srs', 'DefaultSRS': 'srs', 'SRS': 'srs'}
+
+
+def _bbox_param(bbox):
+    """Formaterer en bbox som WFS bbox-parameter; bboxe holdes som floats og laves kun til tekst her."""
+    return ','.join(map(str, bbox))
 
 class WFSClient:
     """
@@ -59,55 +102,72 @@ class WFSClient:
         bbox (list, optional): Bounding box [minx, miny, maxx, maxy]
         debug (bool, optional): Debug mode, default False
         maxfeatures (int, optional): Max antal features per forespørgsel
-        params (dict, optional): Ekstra parametre til WFS forespørgsler
+        outputformat (str, optional): Output format --> Prøv at bruge 'json' hvis den ellers ikke virker
+        params (dict, optional): Ekstra parametre til WFS forespørgsler; et outputFormat heri bruges som outputformat 
+            og sendes kun med GetFeature (ValueError hvis det er angivet forskelligt begge steder)
+        max_workers (int, optional): Maks antal samtidige forespørgsler når data hentes, default 8
     """
-    def __init__(self, url: str, **kwargs):
+    def __init__(self, url: str, *, username=None, password=None, bbox=None, debug=False, maxfeatures=None,
+                 outputformat=None, params=None, max_workers=8):
         self.url = url
-        for key, value in kwargs.items():
-            setattr(self, key, value)
-
-        ## check for outputformat
-        if hasattr(self, 'outputformat'):
-            self.__outputFormat = self.outputformat
-        else:
-            self.__outputFormat = None
-
-        ## check if debug is set
-        if hasattr(self, 'debug'):
-            self.__debug = self.debug
-        else:
-            self.__debug = False
+        self.username = username
+        self.password = password
+        self.bbox = bbox
+        self.debug = debug
+        self.maxfeatures = maxfeatures
+        self.outputformat = outputformat
+        self.params = params
+        self.__outputFormat = outputformat
+        ## et outputFormat i params er per-forespørgsel og indgår ikke i basis-URL'en, så det bruges som outputformat
+        params_format = next((v for k, v in (params or {}).items() if k.lower() == 'outputformat'), None)
+        if params_format is not None:
+            if outputformat is not None and outputformat != params_format:
+                raise ValueError(f'outputformat {outputformat!r} conflicts with outputFormat {params_format!r} in params')
+            self.__outputFormat = params_format
+        self.__debug = debug
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError('max_workers must be a positive integer')
+        self.__max_workers = max_workers
+
+        ## én session til alle forespørgsler, så forbindelserne holdes åbne og genbruges på tværs af trådene
+        self.__session = requests.Session()
+        ## midlertidige serverfejl og throttling forsøges igen med backoff
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+        ## GML og GeoJSON komprimeres godt; svarene pakkes ud af requests, så response.content er de rå bytes
+        self.__session.headers.update({'Accept-Encoding': 'gzip, deflate', 'User-Agent': 'LK-WFS/2'})
+        ## DescribeFeatureType svar pr. feature lag; skemaet ændres ikke mens objektet lever
+        self.__describe_cache = {}
             
         self.__params = {
             'service': 'WFS',
             'request': 'GetCapabilities'}
         
-        if hasattr(self, 'params'):
-            self.__params.update(self.params)     
+        if params is not None:
+            self.__params.update(params)     
 
         ## check if username and password are provided together and add to params
-        if (hasattr(self, 'username') and not hasattr(self, 'password')) or (hasattr(self, 'password') and not hasattr(self, 'username')):
+        if (username is None) != (password is None):
             raise ValueError('Both username and password must be provided')
 
-        if hasattr(self, 'username') and hasattr(self, 'password'):
-            self.__params['username'] = self.username
-            self.__params['password'] = self.password
-        else:
-            self.username = None
-            self.password = None
+        ## brugernavn og adgangskode sendes både som parametre og som basic auth
+        if username is not None:
+            self.__params['username'] = username
+            self.__params['password'] = password
+            self.__session.auth = (username, password)
 
         ## get capabilities
-        url = requests.Request('GET', self.url, params=self.__params).prepare().url
-        if self.__debug: print('GetCapabilities url:', url)
-        response = requests.get(url)
-        root = etree.XML(response.content)
-        if self.__debug: 
-            print('GetCapabilities response:', root)
-        self.get_capabilities_root = root
-        self.__namespace = self.get_capabilities_root.nsmap
-        self.version = root.attrib['version']
-        self.feature_list = self.__get_feature_list()
-        self.operations = self.__get_operations()
+        response = self.__session.get(self.url, params=self.__params, timeout=_TIMEOUT)
+        if self.__debug: print('GetCapabilities url:', response.url)
+        self.operations = self.__parse_capabilities(response.content)
+
+        ## de faste parametre kodes én gang; pr. forespørgsel kodes kun dem der skifter
+        static_params = {k: v for k, v in self.__params.items() if v is not None and k.lower() not in _REQUEST_KEYS}
+        static_params['version'] = self.version
+        separator = '' if self.url.endswith(('?', '&')) else ('&' if '?' in self.url else '?')
+        self.__base_url = f'{self.url}{separator}{urlencode(static_params)}'
         
         if 'GetFeature' in self.operations and 'parameters' in self.operations['GetFeature']:
             if 'resultType' in self.operations['GetFeature']['parameters'] and 'hits' in self.operations['GetFeature']['parameters']['resultType']:
@@ -117,189 +177,205 @@ class WFSClient:
         else:
             self.__can_get_hits = False
 
-        if not hasattr(self, 'maxfeatures'):
+        ## JSON parses hurtigere end GML, så et JSON-format bruges når tjenesten tilbyder det og intet andet er angivet
+        if self.__outputFormat is None:
+            formats = self.operations.get('GetFeature', {}).get('parameters', {}).get('outputFormat', [])
+            self.__outputFormat = next((f for f in formats if 'json' in f.lower()), None)
+
+        if self.maxfeatures is None:
             self.maxfeatures = self.__get_max_features()
 
-        if hasattr(self, 'bbox'):
+        if self.bbox is not None:
             if not isinstance(self.bbox, list):
                 raise ValueError('bbox must be a list of coordinates [minx, miny, maxx, maxy]')
             if len(self.bbox) != 4:
                 raise ValueError('bbox must be a list of coordinates [minx, miny, maxx, maxy]')
             self.bboxes = [[str(b) for b in self.bbox]]
             self.__default_bbox = self.bboxes[0]
+            self.__clip_geom = box(*(float(coord) for coord in self.__default_bbox))
+            ## bboxen forberedes én gang i GEOS og genbruges i hvert intersects-tjek
+            shapely.prepare(self.__clip_geom)
             self.__missing_default_bbox = False
         else:
             self.bboxes = None
             self.__default_bbox = None
+            self.__clip_geom = None
             self.__missing_default_bbox = True
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Lukker HTTP-sessionen, så de genbrugte keep-alive forbindelser frigives.
+
+        Kaldes automatisk, når objektet bruges i en 'with'-blok.
+        """
+        self.__session.close()
+
     def __get_max_features(self):
         """
         Get the maximum number of features that can be returned by the WFS service.
         """
-        constraint = self.get_capabilities_root.find('.//{*}Constraint[@name="CountDefault"]', namespaces=self.get_capabilities_root.nsmap)
-        if constraint is not None:
-            maxfeatures = constraint.find('.//{*}DefaultValue', namespaces=self.get_capabilities_root.nsmap)
-            if maxfeatures is not None:
-                return int(maxfeatures.text)
+        if self.__count_default is not None:
+            return self.__count_default
         print('No max features found, defaulting to 10000')
         return 10000
 
-    def __get_feature_list(self):
+    def __parse_capabilities(self, content):
         """
-        Henter liste over feature lag fra WFS-tjenesten.
+        Gennemløber GetCapabilities svaret én gang og samler det, der skal bruges senere.
 
-        Funktionen laver en liste over tilgængelige feature lag via GetCapabilities.
-        Der hentes navn, titel, beskrivelse, koordinatsystem og bbox for hvert lag.
+        Svaret parses med iterparse filtreret på FeatureType, Operation, Request og Constraint, 
+        og underelementerne i hvert element læses i én løkke i stedet for en find pr. felt. 
+        I samme gennemløb findes:
+            - versionen og feature lagene med navn, titel, beskrivelse, koordinatsystem og bbox
+            - operationerne; for WFS 2.0 med parametrenes tilladte værdier
+            - CountDefault, der bruges som maxfeatures
+
+        Parametre:
+            content (bytes): GetCapabilities svaret
 
         Returnerer:
-            dict: Dictionary med feature lag og deres metadata
+            dict: Operationerne fra tjenesten
         """
         feature_list = {}
-        for feature_type in self.get_capabilities_root.findall(f'.//{{*}}FeatureType', namespaces=self.__namespace):
-            feature = {}
-            feature['name'] = feature_type.find(f'{{*}}Name', namespaces=self.__namespace)
-            if feature['name'] is not None:
-                feature['name'] = feature['name'].text
-            feature['title'] = feature_type.find(f'{{*}}Title', namespaces=self.__namespace)
-            if feature['title'] is not None:
-                feature['title'] = feature['title'].text
-            feature['abstract'] = feature_type.find(f'{{*}}Abstract', namespaces=self.__namespace)
-            if feature['abstract'] is not None:
-                feature['abstract'] = feature['abstract'].text
-            feature['srs'] = feature_type.find(f'{{*}}DefaultCRS', namespaces=self.__namespace)
-            if feature['srs'] is not None:
-                feature['srs'] = feature['srs'].text
-            feature['bbox'] = feature_type.find(f'{{*}}WGS84BoundingBox', namespaces=self.__namespace)
-            if feature['bbox'] is not None:
-                feature['bbox'] = [float(feature['bbox'].find(f'{{*}}LowerCorner', namespaces=self.__namespace).text.split()[0]),
-                                   float(feature['bbox'].find(f'{{*}}LowerCorner', namespaces=self.__namespace).text.split()[1]),
-                                   float(feature['bbox'].find(f'{{*}}UpperCorner', namespaces=self.__namespace).text.split()[0]),
-                                   float(feature['bbox'].find(f'{{*}}UpperCorner', namespaces=self.__namespace).text.split()[1])]
-            else:
-                feature['bbox'] = feature_type.find(f'{{*}}LatLongBoundingBox', namespaces=self.__namespace)
-                if feature['bbox'] is not None:
-                    feature['bbox'] = [float(feature['bbox'].attrib['minx']),
-                                       float(feature['bbox'].attrib['miny']),
-                                       float(feature['bbox'].attrib['maxx']),
-                                       float(feature['bbox'].attrib['maxy'])]
-                else:
-                    if feature['bbox'] is None:
-                        try:
-                            xMin = feature.find('.//{*}LowerCorner').text.split(' ')[0]
-                            yMin = feature.find('.//{*}LowerCorner').text.split(' ')[1]
-                            xMax = feature.find('.//{*}UpperCorner').text.split(' ')[0]
-                            yMax = feature.find('.//{*}UpperCorner').text.split(' ')[1]
-                            feature['bbox'] = [float(xMin), float(yMin), float(xMax), float(yMax)]
-                        except:
-                            feature['bbox'] = None
-            feature_list[feature['name'].split(':')[-1]] = feature
-            
-        return feature_list
-
-    def __get_operations(self):
-        """
-        Get the list of operations from the WFS service.
-        """
         operations = {}
-        if self.version >= '2.0.0':
-            for operation in self.get_capabilities_root.findall(f'.//{{*}}Operation', namespaces=self.__namespace):
-                op_name = operation.attrib['name']
-                operations[op_name] = {}
+        requests_1x = {}
+        count_default = None
+        context = etree.iterparse(io.BytesIO(content), events=('end',), tag=_CAPABILITIES_TAGS)
+        for _, element in context:
+            tag = etree.QName(element).localname
+            if tag == 'FeatureType':
+                feature = self.__read_feature_type(element)
+                if feature['name'] is not None:
+                    feature_list[feature['name'].split(':')[-1]] = feature
+            elif tag == 'Operation':
                 parameters = {}
-                for parameter in operation.findall(f'{{*}}Parameter', namespaces=self.__namespace):
-                    name = parameter.attrib['name']
-                    # parameters[name] = {}
-                    AllowedValues = parameter.find(f'{{*}}AllowedValues', namespaces=self.__namespace)
-                    if AllowedValues is not None:
-                        values = AllowedValues.findall(f'{{*}}Value', namespaces=self.__namespace)
-                        if values is not None:
-                            parameters[name] = [value.text for value in values]
-                operations[op_name]['parameters'] = parameters
-            return operations
-        elif self.version < '2.0.0':
-            for item in self.get_capabilities_root.findall(f'.//{{*}}Request', namespaces=self.__namespace):
-                for req in item:
-                    op_name = req.tag.split('}')[-1]
-                    operations[op_name] = {}
-            return operations
-        else:
-            return None                  
+                for parameter in element.iterchildren('{*}Parameter'):
+                    allowed_values = parameter.find('{*}AllowedValues')
+                    if allowed_values is not None:
+                        parameters[parameter.attrib['name']] = [value.text for value in allowed_values.iterchildren('{*}Value')]
+                operations[element.attrib['name']] = {'parameters': parameters}
+            elif tag == 'Request':
+                for req in element.iterchildren(tag=etree.Element):
+                    requests_1x[etree.QName(req).localname] = {}
+            elif count_default is None and element.get('name') == 'CountDefault':
+                default_value = next(element.iter('{*}DefaultValue'), None)
+                if default_value is not None:
+                    count_default = int(default_value.text)
+
+        root = context.root
+        if self.__debug: 
+            print('GetCapabilities response:', root)
+        self.get_capabilities_root = root
+        self.version = root.attrib['version']
+        self.feature_list = feature_list
+        self.__count_default = count_default
+        ## WFS 2.0 beskriver operationerne som ows:Operation, de ældre versioner som underelementer af Request
+        return operations if self.version >= '2.0.0' else requests_1x
+
+    def __read_feature_type(self, element):
+        """Læser navn, titel, beskrivelse, koordinatsystem og bbox for en FeatureType i én løkke over underelementerne."""
+        feature = {'name': None, 'title': None, 'abstract': None, 'srs': None, 'bbox': None}
+        latlong_bbox = None
+        for child in element.iterchildren(tag=etree.Element):
+            tag = etree.QName(child).localname
+            key = _FEATURE_TYPE_KEYS.get(tag)
+            if key is not None:
+                if feature[key] is None:
+                    feature[key] = child.text
+            elif tag == 'WGS84BoundingBox' and feature['bbox'] is None:
+                lower = child.find('{*}LowerCorner').text.split()
+                upper = child.find('{*}UpperCorner').text.split()
+                feature['bbox'] = [float(lower[0]), float(lower[1]), float(upper[0]), float(upper[1])]
+            elif tag == 'LatLongBoundingBox' and latlong_bbox is None:
+                latlong_bbox = [float(child.attrib[k]) for k in ('minx', 'miny', 'maxx', 'maxy')]
+        ## WGS84BoundingBox foretrækkes frem for LatLongBoundingBox
+        if feature['bbox'] is None:
+            feature['bbox'] = latlong_bbox
+        return feature
         
-    def __split_bbox(self, bbox):
+    def __split_bbox(self, bbox, hits=None):
         """
-        Opdeler en bounding box i to mindre bounding boxes.
+        Opdeler en bounding box i mindre bounding boxes.
         
-        Funktionen tager en bounding box og opdeler den i to mindre bounding boxes
-        langs den længste side. De nye bounding boxes tilføjes til self.bboxes.
+        Kendes antallet af hits, opdeles bboxen på én gang i et gitter på n x n lige store felter, 
+        hvor n = ceil(sqrt(hits / maxfeatures)), så hvert felt i gennemsnit har under maxfeatures 
+        features. Uden hits halveres bboxen langs den længste side. Felter der stadig har for 
+        mange features opdeles igen.
         
         Parametre:
-            bbox (list): Liste med fire koordinater [minx, miny, maxx, maxy]
+            bbox (tuple): Fire koordinater (minx, miny, maxx, maxy) som floats
+            hits (int, optional): Antal features i bboxen
             
-        Tilføjer:
-            De to nye bounding boxes til self.bboxes listen
+        Returnerer:
+            list: Liste med de nye bounding boxes som tupler af floats
         """
-        minx = float(bbox[0])
-        miny = float(bbox[1])
-        maxx = float(bbox[2])
-        maxy = float(bbox[3])
-
-        if (maxx - minx) < (maxy - miny):
-            bb1 = [str(minx), str(miny), str(maxx), str(miny + ((maxy - miny) / 2))]
-            bb2 = [str(minx), str(miny + ((maxy - miny) / 2)), str(maxx), str(maxy)]
-            return [bb1, bb2]
-        else:
-            bb1 = [str(minx), str(miny), str(minx + ((maxx - minx) / 2)), str(maxy)]
-            bb2 = [str(minx + ((maxx - minx) / 2)), str(miny), str(maxx), str(maxy)]
-            return [bb1, bb2]
+        if hits is not None:
+            n = max(2, math.ceil(math.sqrt(hits / self.maxfeatures)))
+            xs = np.linspace(bbox[0], bbox[2], n + 1).tolist()
+            ys = np.linspace(bbox[1], bbox[3], n + 1).tolist()
+            return [(xs[i], ys[j], xs[i + 1], ys[j + 1]) for i in range(n) for j in range(n)]
+
+        ## halveres langs den længste akse; ved lige lange sider deles langs x
+        bb = np.asarray(bbox, dtype=np.float64)
+        axis = int(np.argmax(bb[2:] - bb[:2]))
+        mid = (bb[axis] + bb[axis + 2]) / 2
+        lower, upper = bb.copy(), bb.copy()
+        lower[axis + 2] = mid
+        upper[axis] = mid
+        return [tuple(lower.tolist()), tuple(upper.tolist())]
         
-    def __clip_gdf(self, tmp_gdf):
+    def __clip_gdf(self, tmp_gdf, exact=False):
         """
-        Klipper en GeoDataFrame til bounding box defineret i WFS-objektet.
+        Afgrænser en GeoDataFrame til bounding box defineret i WFS-objektet.
+        
+        Som standard beholdes de features, der skærer bboxen, uden at geometrierne skæres til; 
+        tjenesten har allerede filtreret på bbox, så der skal kun sorteres de features fra, 
+        der ligger helt udenfor. Alle geometrier testes i ét vektoriseret kald mod den 
+        forberedte bbox, så der ikke skal bygges et indeks for en enkelt forespørgsel. 
+        Med exact=True klippes geometrierne til bboxen med gpd.clip.
         
         Parametre:
             gdf (GeoDataFrame): GeoDataFrame der skal klippes
+            exact (bool): Hvis True, skæres geometrierne til bboxen (default False)
             
         Returnerer:
-            GeoDataFrame: Klippet GeoDataFrame
+            GeoDataFrame: Afgrænset GeoDataFrame
         """
         # tmp_gdf = gdf.copy()
         # tmp_gdf.crs = "EPSG:4326"
         # tmp_gdf = tmp_gdf.to_crs("EPSG:25832")
-        gdf_bbox = box(float(self.__default_bbox[0]), float(self.__default_bbox[1]), float(self.__default_bbox[2]), float(self.__default_bbox[3]))
-        gdf_bbox = gpd.GeoDataFrame({'geometry': [gdf_bbox]})
-        gdf_bbox.crs = "EPSG:25832"
-        try:
-            tmp_gdf.set_crs("EPSG:25832", inplace=True)
+        gdf_bbox = self.__clip_geom
+        ## bboxen er i EPSG:25832; data uden CRS antages at være det, data i en anden CRS projiceres inden filtreringen
+        if tmp_gdf.crs is None:
+            tmp_gdf = tmp_gdf.set_crs("EPSG:25832")
+        elif tmp_gdf.crs.to_epsg() != 25832:
             tmp_gdf = tmp_gdf.to_crs("EPSG:25832")
-        except Exception as e:
-            if self.__debug: print(e)
-            pass
         if self.__debug:
             print('Clipping GeoDataFrame to bounding box')
             print(float(self.__default_bbox[0]), float(self.__default_bbox[1]), float(self.__default_bbox[2]), float(self.__default_bbox[3]))
             print(tmp_gdf.crs)
-            print(gdf_bbox.crs)
-        gdf = gpd.clip(tmp_gdf, gdf_bbox)
+        if exact:
+            gdf = gpd.clip(tmp_gdf, gdf_bbox)
+        else:
+            gdf = tmp_gdf[shapely.intersects(tmp_gdf.geometry.values, gdf_bbox)]
         if self.__debug: print('Clipped GeoDataFrame:')
         return gdf
     
+    def __request_url(self, request, feature_name, **params):
+        """Danner URL'en til en forespørgsel ud fra basis-URL'en; kun request, lagnavn og de givne parametre kodes."""
+        type_key = 'typeName' if self.version in ('1.0.0', '1.1.0') else 'typeNames'
+        return f"{self.__base_url}&{urlencode({'request': request, type_key: feature_name, **params})}"
+
     def __get_hits(self, feature_name, bbox):
-        params = self.__params.copy()
-        params.update({
-            'request': 'GetFeature',
-            'resulttype': 'hits',
-            'version': self.version,
-            'bbox': ','.join(bbox)
-        })
-        if self.version in ('1.0.0', '1.1.0'):
-            params['typeName'] = feature_name
-        else:
-            params['typeNames'] = feature_name
-        
-        wfs_url = requests.Request('GET', self.url, params=params).prepare().url
-        if self.__debug: print('hits url: ', wfs_url)
-        response = requests.get(wfs_url)
+        url = self.__request_url('GetFeature', feature_name, resulttype='hits', bbox=_bbox_param(bbox))
+        response = self.__session.get(url, timeout=_TIMEOUT)
+        if self.__debug: print('hits url: ', response.url)
         root = etree.XML(response.content)
         hits = int(root.attrib['numberMatched'])
         return hits
@@ -309,7 +385,8 @@ class WFSClient:
         Henter metadata for et specifikt feature lag fra WFS-tjenesten.
         
         Funktionen danner en WFS GetFeature forespørgsel med resulttype=describeFeature
-        og returnerer metadata som en GeoDataFrame.
+        og returnerer metadata som en GeoDataFrame. Svaret huskes pr. feature lag, så 
+        gentagne kald til get_features ikke spørger tjenesten igen.
         
         Parametre:
             feature_name (str): Navnet på det ønskede feature lag
@@ -320,28 +397,27 @@ class WFSClient:
         Raises:
             ValueError: Hvis GeoDataFrame ikke kan læses fra WFS-responsen
         """
+        if feature_name in self.__describe_cache:
+            return self.__describe_cache[feature_name]
         if self.__debug: print('Getting DescribeFeatureType')
-        params = self.__params
-        params['request'] = 'DescribeFeatureType'
-        params['version'] = self.version
-        if self.version in ('1.0.0', '1.1.0'):
-            params['typename'] = feature_name
-        else:
-            params['typeNames'] = feature_name
-        if self.__debug: print('params:', params)
-        wfs_url = requests.Request('GET', self.url, params=params).prepare().url
+        url = self.__request_url('DescribeFeatureType', feature_name)
+        response = self.__session.get(url, timeout=_TIMEOUT)
         if self.__debug: 
             print('Getting DescribeFeatureType')
-            print(wfs_url)
+            print(response.url)
 
-        response = requests.get(wfs_url)
         root = etree.XML(response.content)
-        ns = root.nsmap
+        desc = self.__schema_fields(root)
+        self.__describe_cache[feature_name] = desc
+        return desc
+
+    def __schema_fields(self, node):
+        """Inddeler elementerne under complexContent i node efter type (ints, decimals, datetimes, fc_schema)."""
         ints = []
         decimals = []
         datetimes = []
         fc_schema = []
-        for e in root.findall(f'.//{{*}}complexContent//{{*}}element', namespaces=ns):
+        for e in _XP_SCHEMA_ELEMENTS(node):
             e = e.attrib
             dtype = e['type']
             # if self.__debug: print(f'Element: {e} - Type: {dtype}')
@@ -356,121 +432,236 @@ class WFSClient:
         # if self.__debug: print(f'ints: {ints} - decimals: {decimals} - datetimes: {datetimes} - fc_schema: {fc_schema}')
         return {'ints':ints, 'decimals':decimals, 'datetimes':datetimes, 'fc_schema':fc_schema}
 
-    def __get_feature(self, feature_name, bbox):
-        params = self.__params.copy()
-        params.update({
-            'resulttype': 'results',
-            'request': 'GetFeature',
-            'bbox': ','.join(bbox),
-            'version': self.version
-        })
-        if self.version in ('1.0.0', '1.1.0'):
-            params['typeName'] = feature_name
-        else:
-            params['typeNames'] = feature_name
+    def describe_features(self, feature_names):
+        """
+        Henter metadata for flere feature lag i én DescribeFeatureType forespørgsel.
+
+        Lagene sendes samlet som typeNames=a,b,c, og det returnerede skema deles op pr. lag 
+        ud fra skemaets elementer og deres complexType. Resultatet huskes, så get_features 
+        ikke spørger igen. Lag der ikke kan findes i det samlede svar (fx hvis tjenesten 
+        kun svarer med xsd:import), hentes enkeltvis.
+
+        Parametre:
+            feature_names (list): Navne på de ønskede feature lag
 
-        if self.__outputFormat and self.__outputFormat.lower() == 'json':
-            params['outputFormat'] = 'json'
+        Returnerer:
+            dict: Metadata pr. feature lag, som fra get_features' DescribeFeatureType
+        """
+        missing = [name for name in feature_names if name not in self.__describe_cache]
+        if len(missing) > 1:
+            url = self.__request_url('DescribeFeatureType', ','.join(missing))
+            try:
+                response = self.__session.get(url, timeout=_TIMEOUT)
+                if self.__debug: print('DescribeFeatureType url:', response.url)
+                root = etree.XML(response.content)
+                complex_types = {ct.get('name'): ct for ct in root.iterchildren('{*}complexType')}
+                short_names = {name.split(':')[-1]: name for name in missing}
+                for element in root.iterchildren('{*}element'):
+                    feature_name = short_names.get(element.get('name'))
+                    complex_type = complex_types.get((element.get('type') or '').split(':')[-1])
+                    if feature_name is not None and complex_type is not None:
+                        self.__describe_cache[feature_name] = self.__schema_fields(complex_type)
+            except (requests.RequestException, etree.XMLSyntaxError) as e:
+                if self.__debug: print(f'Could not get DescribeFeatureType for {missing}: {e}')
+        return {name: self.__descripe_feature(name) for name in feature_names}
+
+    def __get_feature(self, feature_name, bbox, columns=None):
+        params = {'resulttype': 'results', 'bbox': _bbox_param(bbox)}
+        if self.__outputFormat:
+            params['outputFormat'] = self.__outputFormat
+        ## lag i EPSG:25832 bedes svare i den, da en JSON-tjeneste efter RFC 7946 ellers svarer i WGS84
+        srs = self.feature_list.get(feature_name, {}).get('srs')
+        srs_name = 'EPSG:25832' if srs and re.split(r'[:/]', srs.strip())[-1] == '25832' else None
+        if srs_name is not None:
+            params['srsName'] = srs_name
+        url = self.__request_url('GetFeature', feature_name, **params)
         
-        wfs_url = requests.Request('GET', self.url, params=params).prepare().url
-        if self.__debug: print('___get_features_gdf', wfs_url)
+        if self.__debug: print('___get_features_gdf', url)
+        ## svaret hentes én gang via sessionen og læses fra hukommelsen, så GDAL ikke henter URL'en igen
         try:
-            return gpd.read_file(wfs_url, crs="EPSG:25832")
+            response = self.__session.get(url, timeout=_FEATURE_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise ValueError('Could not read GeoDataFrame from WFS response', e)
+        ## med pyogrio oprettes kun de valgte kolonner; uden udvælges de efter læsningen
+        read_kwargs = dict(_READ_ENGINE, columns=columns) if columns is not None and _READ_ENGINE else _READ_ENGINE
+        try:
+            gdf = gpd.read_file(io.BytesIO(response.content), **read_kwargs)
+            if columns is not None and not _READ_ENGINE:
+                gdf = gdf[[col for col in columns if col in gdf.columns] + [gdf.geometry.name]]
         except ValueError as e:
             if str(e) == "Null layer: ''":
                 raise ValueError('No features found in WFS response')
+            raise ValueError('Could not read GeoDataFrame from WFS response', e)
         except Exception as e:
-            # return gpd.read_file(wfs_url)
             raise Exception('Could not read GeoDataFrame from WFS response')
+        ## GDAL sætter WGS84 på GeoJSON uden crs; ligger koordinaterne udenfor længde og bredde, er de i den CRS der blev bedt om
+        if srs_name is not None and gdf.crs is not None and gdf.crs.to_epsg() == 4326 and len(gdf) > 0 and np.abs(gdf.total_bounds).max() > 180:
+            gdf = gdf.set_crs(srs_name, allow_override=True)
+        ## svar uden CRS får lagets DefaultCRS; kendes den ikke, lades CRS'en være tom
+        if gdf.crs is None and srs is not None:
+            try:
+                gdf = gdf.set_crs(srs_name or srs)
+            except pyproj.exceptions.CRSError as e:
+                if self.__debug: print(f'Unknown CRS {srs}: {e}')
+        ## bbox og klipning er i EPSG:25832, så data i en anden CRS projiceres med det samme
+        if gdf.crs is not None and gdf.crs.to_epsg() != 25832:
+            gdf = gdf.to_crs("EPSG:25832")
+        return gdf
 
-    def get_features(self, feature_name, **kvargs):
+    def __to_datetime(self, series):
+        """
+        Konverterer en kolonne med ISO 8601 datoer til datetime uden tidszone.
+
+        Kolonnen parses i ét vektoriseret kald. Tidszonen fjernes, så den lokale tid bevares 
+        (2020-06-14T11:18:45.344+02:00 bliver 2020-06-14 11:18:45.344). Har kolonnen blandede 
+        tidszoner, fjernes offset fra teksten før parsningen. Kun hvis intet kan parses, 
+        prøves den gamle fremgangsmåde, hvor brøkdele af sekunder skæres af teksten.
+
+        Parametre:
+            series (Series): Kolonnen der skal konverteres
+
+        Returnerer:
+            Series: Kolonnen som datetime64 uden tidszone
+        """
+        try:
+            converted = pd.to_datetime(series, format='ISO8601', errors='coerce')
+        except ValueError:
+            ## blandede tidszoner; offset fjernes så den lokale tid bruges
+            naive = series.astype(str).str.replace(r'(Z|[+-]\d{2}:?\d{2})$', '', regex=True)
+            converted = pd.to_datetime(naive, format='ISO8601', errors='coerce')
+        if isinstance(converted.dtype, pd.DatetimeTZDtype):
+            converted = converted.dt.tz_localize(None)
+        elif not pd.api.types.is_datetime64_dtype(converted.dtype):
+            naive = series.astype(str).str.replace(r'(Z|[+-]\d{2}:?\d{2})$', '', regex=True)
+            converted = pd.to_datetime(naive, format='ISO8601', errors='coerce')
+        if converted.isna().all() and series.notna().any():
+            text = series.astype(str).str.replace('T', ' ').str.split('.').str[0]
+            converted = pd.to_datetime(text, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        return converted
+
+    def __drop_duplicates(self, gdf):
+        """
+        Fjerner features der er hentet i flere felter.
+
+        Har svaret et feature id (gml_id eller fid), bruges det alene. Ellers sammenlignes 
+        attributterne og geometriens WKB, så geometri-objekterne ikke skal hashes.
+
+        Parametre:
+            gdf (GeoDataFrame): De samlede features
+
+        Returnerer:
+            GeoDataFrame: Features uden dubletter
+        """
+        id_column = next((col for col in _ID_COLUMNS if col in gdf.columns), None)
+        if id_column is not None:
+            return gdf.drop_duplicates(subset=id_column)
+        dedup_key = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+        dedup_key['_wkb'] = shapely.to_wkb(gdf.geometry.values)
+        return gdf[~dedup_key.duplicated().to_numpy()]
+
+    def __submit(self, executor, kind, feature_name, bbox, columns=None):
+        """Sender en hits- eller GetFeature-forespørgsel for en bbox til trådpuljen."""
+        if kind == 'hits':
+            return executor.submit(self.__get_hits, feature_name, bbox)
+        return executor.submit(self.__get_feature, feature_name, bbox, columns)
+
+    def get_features(self, feature_name, *, clip_gdf=True, clip_geom_exact=False, columns=None):
         """
         Hent features fra et WFS lag.
 
         Funktionen laver en WFS GetFeature forespørgsel og returnerer data som GeoDataFrame.
         Den håndterer automatisk opdeling i mindre bbox'e, hvis der er for mange features.
+        Forespørgslerne for de enkelte bbox'e sendes samtidigt fra en trådpulje.
 
         Parametre:
             feature_name (str): Navn på det ønskede WFS lag
-            **kvargs: Ekstra parametre der tilføjes WFS forespørgslen
+            clip_gdf (bool): Hvis True, afgrænses data til bbox (default True)
+            clip_geom_exact (bool): Hvis True, skæres geometrierne til bbox med gpd.clip; 
+                ellers beholdes features der skærer bbox uændret (default False)
+            columns (list): Attributkolonner der skal med; geometrien kommer altid med (default alle)
                 
         Returnerer:
-            GeoDataFrame: GeoDataFrame med features fra WFS laget
+            GeoDataFrame: GeoDataFrame med features fra WFS laget i EPSG:25832
             
         Raises:
             ValueError: Hvis GeoDataFrame ikke kan læses fra WFS responsen
         """
-        for key, value in kvargs.items():
-            setattr(self, key, value)
-        
-        ## check if clip_gdf is set
-        if hasattr(self, 'clip_gdf'):
-            clip_gdf = self.clip_gdf
-        else:
-            clip_gdf = True
-
         if self.bboxes is None:
-            self.bboxes = [[str(b) for b in self.feature_list[feature_name]['bbox']]]
+            ## Lagets bbox er angivet i WGS84 og omregnes til EPSG:25832 inden den bruges
+            bounds = _TRANSFORMER_4326_TO_25832.transform_bounds(*self.feature_list[feature_name]['bbox'])
+            self.bboxes = [[str(b) for b in bounds]]
             self.__default_bbox = self.bboxes[0]
+            self.__clip_geom = box(*bounds)
+            shapely.prepare(self.__clip_geom)
 
-        bboxes = self.bboxes.copy()
         if self.__debug: print(f'Bounding boxes: {self.bboxes}')
         gdfs = []
-        for bbox in bboxes:
-            if self.__debug: print(f'Bounding box: {bbox}')
-            if self.__can_get_hits:
-                hits = self.__get_hits(feature_name, bbox)
-                if hits > self.maxfeatures:
-                    if self.__debug: print(f'Number of features ({hits}) is greater than maxfeatures ({self.maxfeatures}), splitting bounding box')
-                    for bb in self.__split_bbox(bbox):
-                        bboxes.append(bb)
-                elif hits == 0:
-                    if self.__debug: print(f'No features found in bounding box: {bbox}')
-                    continue
-                else:
-                    gdf = self.__get_feature(feature_name, bbox)
-                    gdfs.append(gdf)
-            else:
-                gdf = self.__get_feature(feature_name, bbox)
-                if len(gdf) > self.maxfeatures:
-                    if self.__debug: print(f'Number of features ({len(gdf)}) is greater than maxfeatures ({self.maxfeatures}), splitting bounding box')
-                    for bb in self.__split_bbox(bbox):
-                        bboxes.append(bb)
-                else:
-                    gdfs.append(gdf)
+        ## hits og GetFeature for bboxene køres samtidigt i en arbejdskø; opdelte bboxe sættes i kø igen, så snart deres antal kendes
+        first_kind = 'hits' if self.__can_get_hits else 'features'
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            ## internt holdes bboxene som tupler af floats; de laves kun til tekst når forespørgslen dannes
+            bboxes = [tuple(map(float, bbox)) for bbox in self.bboxes]
+            pending = {self.__submit(executor, first_kind, feature_name, bbox, columns): (first_kind, bbox) for bbox in bboxes}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, bbox = pending.pop(future)
+                    if self.__debug: print(f'Bounding box: {bbox}')
+                    if kind == 'hits':
+                        hits = future.result()
+                        if hits > self.maxfeatures:
+                            if self.__debug: print(f'Number of features ({hits}) is greater than maxfeatures ({self.maxfeatures}), splitting bounding box')
+                            children = self.__split_bbox(bbox, hits)
+                            ## ligger det forventede antal pr. felt godt under maxfeatures, hentes felterne direkte uden hits
+                            child_kind = 'estimated' if hits / len(children) <= _SKIP_HITS_RATIO * self.maxfeatures else 'hits'
+                            for bb in children:
+                                pending[self.__submit(executor, child_kind, feature_name, bb, columns)] = (child_kind, bb)
+                        elif hits == 0:
+                            if self.__debug: print(f'No features found in bounding box: {bbox}')
+                        else:
+                            pending[self.__submit(executor, 'features', feature_name, bbox, columns)] = ('features', bbox)
+                    elif kind == 'estimated':
+                        gdf = future.result()
+                        if len(gdf) >= self.maxfeatures:
+                            ## felt hentet uden hits ramte grænsen og kan være afkortet; antallet hentes så feltet kan opdeles
+                            pending[self.__submit(executor, 'hits', feature_name, bbox, columns)] = ('hits', bbox)
+                        elif len(gdf) > 0:
+                            ## tomme felter springes over; mindst ét felt har features, så resultatet får stadig et skema
+                            gdfs.append(gdf)
+                    else:
+                        gdf = future.result()
+                        if not self.__can_get_hits and len(gdf) > self.maxfeatures:
+                            if self.__debug: print(f'Number of features ({len(gdf)}) is greater than maxfeatures ({self.maxfeatures}), splitting bounding box')
+                            for bb in self.__split_bbox(bbox):
+                                pending[self.__submit(executor, 'features', feature_name, bb, columns)] = ('features', bb)
+                        else:
+                            gdfs.append(gdf)
         if len(gdfs) == 0:
             raise ValueError('No features found in WFS response')
         self.gdfs = gdfs
         gdf = pd.concat(gdfs, ignore_index=True)
         if self.__debug: print(f'Number of features: {len(gdf)}')
-        gdf.drop_duplicates(inplace=True)
-        for col in gdf.columns.to_list():
-            if self.__debug:
-                print("Original columns:", gdf.columns.to_list())
-            gdf.rename(columns={col: col.replace('.', '_').replace('-', '_') for col in gdf.columns}, inplace=True)
-            if self.__debug:
-                print("Renamed columns:", gdf.columns.to_list())
+        ## dubletter opstår kun mellem felter, så med ét felt springes tjekket over
+        if len(gdfs) > 1:
+            gdf = self.__drop_duplicates(gdf)
+        if self.__debug:
+            print("Original columns:", gdf.columns.to_list())
+        ## punktummer og bindestreger erstattes i én vektoriseret omdøbning af alle kolonner
+        gdf.columns = gdf.columns.str.replace('.', '_', regex=False).str.replace('-', '_', regex=False)
+        if self.__debug:
+            print("Renamed columns:", gdf.columns.to_list())
 
         gdf['xTid'] = pd.Timestamp.now()
         if clip_gdf and len(gdf) > 0:
-            gdf = self.__clip_gdf(gdf)
+            gdf = self.__clip_gdf(gdf, exact=clip_geom_exact)
 
         describe_feature = self.__descripe_feature(feature_name)
         if len(gdf) > 0:
-            for col in gdf.columns.to_list():
-                if col in describe_feature['datetimes']:
-                    try:
-                        gdf[col] = pd.to_datetime(gdf[col]).dt.tz_localize(None)
-                    except Exception as e:
-                        if self.__debug: print(f'Could not convert {col} to datetime: {e}')
-                        try:
-                            gdf[col] = pd.to_datetime(gdf[col], errors='coerce').dt.tz_localize(None)
-                        except Exception as e:
-                            if self.__debug: print(f'Could not convert {col} to datetime: {e}')
-                            try:
-                                gdf[col] = gdf[col].astype(str).str.replace('T', ' ').str.split('.').str[0]
-                                gdf[col] = pd.to_datetime(gdf[col], format='%Y-%m-%d %H:%M:%S', errors='coerce').dt.tz_localize(None)
-                            except Exception as e:
-                                if self.__debug: print(f'Could not convert {col} to datetime: {e} at all')
+            for col in [c for c in gdf.columns if c in describe_feature['datetimes']]:
+                try:
+                    gdf[col] = self.__to_datetime(gdf[col])
+                except Exception as e:
+                    if self.__debug: print(f'Could not convert {col} to datetime: {e}')
 
         return gdf
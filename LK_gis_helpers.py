@@ -1,16 +1,45 @@
 """
 ******* GIS-hjælpefunktioner *******
-* Import dem med 'from LK_gis_helpers import addESRIGeom, ESRIclip'
+* Import dem med 'from LK_gis_helpers import addESRIGeom, iter_esri_rows, ESRIclip'
 * Tilføj geometri til en GeoDataFrame med 'addESRIGeom(df, drop_geom)'
-* Klip en GeoDataFrame til en bounding box med 'ESRIclip(gdf, bbox)'
+* Indsæt rækker direkte med en InsertCursor med 'cursor.insertRow(row) for row in iter_esri_rows(df, fields)'
+* Afgræns en GeoDataFrame til en bounding box med 'ESRIclip(gdf, bbox)' eller klip den med 'ESRIclip(gdf, bbox, mode='clip')'
+* Beskriv feature classes i en geodatabase med 'describeFC(sde, schema, feature_class)'
 
 """
 
 import arcpy
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import geopandas as gpd
-from shapely.geometry import Polygon
+import numpy as np
+from shapely.geometry import box
 import pandas as pd
 
+# feltnavne fra arcpy.Describe oversat til de typenavne, som AddField bruger
+_FIELD_TYPES = {
+    'Blob': 'BLOB',
+    'BigInteger': 'BIGINTEGER',
+    'Date': 'DATE',
+    'DateOnly': 'DATEONLY',
+    'Double': 'DOUBLE',
+    'Geometry': 'GEOMETRY',
+    'GlobalID': 'GLOBALID',
+    'Guid': 'GUID',
+    'Integer': 'LONG',
+    'OID': 'OID',
+    'Raster': 'RASTER',
+    'Single': 'FLOAT',
+    'SmallInteger': 'SHORT',
+    'String': 'TEXT',
+    'TimeOnly': 'TIMEONLY',
+    'TimeStampOffset': 'TIMESTAMPOFFSET'
+}
+
+# kolonnerne i describeFC's resultat
+_DESCRIBE_COLUMNS = ['Feature class', 'Feature type', 'Has M', 'Has Z', 'Coordinate system', 'Coordinate system name', 'Fields', 'Fields dict', 'Spatial Reference']
+
 
 def addESRIGeom(df, drop_geom = False):
     """
@@ -31,24 +60,70 @@ def addESRIGeom(df, drop_geom = False):
     -------------
     - Funktionen bruger `arcpy.FromWKT` til at konvertere geometri fra Well-Known Text (WKT) til ArcPy-format.
     - SpatialReference EPSG:25832 bruges som standard, hvilket svarer til UTM Zone 32N (ETRS89).
+    - Kopien er overfladisk; de eksisterende kolonner deles med `df`, så data ikke kopieres.
     """
-    tmp_df = df.copy(deep=True)
+    tmp_df = df.copy(deep=False)
     geometry_field_name = tmp_df.geometry.name
-    tmp_df['temp_wkt_field'] = tmp_df[geometry_field_name].to_wkt()
-    tmp_df['SHAPE@'] = tmp_df['temp_wkt_field'].apply(lambda geom: arcpy.FromWKT(geom, arcpy.SpatialReference(25832)))
-    tmp_df.drop(columns=['temp_wkt_field'], inplace=True)
+    tmp_df['SHAPE@'] = [row[0] for row in iter_esri_rows(tmp_df, ['SHAPE@'])]
     if drop_geom == True:
         tmp_df.drop(columns=[geometry_field_name], inplace=True)
     return tmp_df        
 
-def ESRIclip(gdf, bbox):
+def iter_esri_rows(df, fields, sr_epsg=25832):
+    """
+    Giver rækkerne i en GeoDataFrame som tupler, der kan indsættes direkte med `arcpy.da.InsertCursor`.
+
+    I modsætning til `addESRIGeom` bygges der ingen kopi af tabellen og ingen kolonne med 
+    ArcPy-geometrier; hver geometri konverteres først, når dens række gives videre til cursoren.
+
+    Parametre:
+    ----------
+    - df: GeoDataFrame, der indeholder geospatiale data og en geometri-kolonne.
+    - fields: Liste med feltnavne i samme rækkefølge som InsertCursor'en er oprettet med. 
+      Feltet `SHAPE@` giver geometrien i ArcPy-format; de øvrige hentes fra kolonnerne med samme navn.
+    - sr_epsg: EPSG-kode for geometriernes SpatialReference. Standard er 25832.
+
+    Returnerer:
+    -----------
+    - En generator med en tuple pr. række.
+
+    Eksempel:
+    ---------
+    >>> fields = ['navn', 'SHAPE@']
+    >>> with arcpy.da.InsertCursor(fc, fields) as cursor:
+    ...     for row in iter_esri_rows(gdf, fields):
+    ...         cursor.insertRow(row)
+    """
+    # SpatialReference oprettes én gang og genbruges for alle rækker
+    sr = arcpy.SpatialReference(sr_epsg)
+    shape_positions = [i for i, field in enumerate(fields) if field == 'SHAPE@']
+    columns = [field for field in fields if field != 'SHAPE@']
+    # WKT dannes for hele geometri-kolonnen på én gang; ArcPy-geometrien laves først når rækken gives videre
+    wkts = df.geometry.to_wkt().to_numpy() if shape_positions else None
+    # uden andre felter end SHAPE@ giver itertuples ingen rækker, så der bruges tomme tupler
+    rows = df[columns].itertuples(index=False, name=None) if columns else (() for _ in range(len(df)))
+    for i, values in enumerate(rows):
+        if not shape_positions:
+            yield values
+            continue
+        row = list(values)
+        geom = arcpy.FromWKT(wkts[i], sr)
+        for pos in shape_positions:
+            row.insert(pos, geom)
+        yield tuple(row)
+
+def ESRIclip(gdf, bbox, mode='filter'):
     """
-    Klipper en GeoDataFrame til en specificeret bounding box (bbox).
+    Afgrænser eller klipper en GeoDataFrame til en specificeret bounding box (bbox).
 
-    Denne funktion tager en GeoDataFrame (`gdf`) og klipper dens geometri til at være 
-    inden for en angivet bounding box (`bbox`). Bounding box specificeres som en liste 
+    Denne funktion tager en GeoDataFrame (`gdf`) og finder de geometrier, der skærer 
+    en angivet bounding box (`bbox`). Bounding box specificeres som en liste 
     med fire koordinater: [min_x, min_y, max_x, max_y].
 
+    Kandidaterne findes via GeoDataFrame'ens spatiale indeks, så kun geometrier hvis 
+    udstrækning rammer bboxen testes. Med `mode='filter'` beholdes de fundne geometrier 
+    uændret; med `mode='clip'` skæres de til bboxen med `gpd.clip`.
+
     Parametre:
     ----------
     gdf : GeoDataFrame
@@ -56,6 +131,9 @@ def ESRIclip(gdf, bbox):
     bbox : list
         En liste med fire koordinater [min_x, min_y, max_x, max_y], der definerer 
         den bounding box, som gdf skal klippes til.
+    mode : str
+        'filter' (standard) beholder geometrierne der skærer bboxen uændret, 
+        'clip' skærer dem til bboxen.
 
     Returnerer:
     -----------
@@ -63,83 +141,84 @@ def ESRIclip(gdf, bbox):
         En ny GeoDataFrame, som indeholder geometrierne fra `gdf`, der er inden for 
         den specificerede bounding box.
     """
-    min_x = bbox[0]
-    min_y = bbox[1]
-    max_x = bbox[2]
-    max_y = bbox[3]
-    polygons = []
-    corners = [(min_x, min_y), (min_x, max_y), (max_x, max_y), (max_x, min_y), (min_x, min_y)]
-    
-    polygon = Polygon(corners)
-    polygons.append(polygon)
-    
-    # Opretter en polygon fra hjørnerne
-    clip_gdf = gpd.GeoDataFrame(geometry=gpd.GeoSeries(polygons))
-    clip_gdf.set_crs(epsg=25832, inplace=True)
-    tmp_gdf = gpd.clip(gdf, clip_gdf)
+    if mode not in ('filter', 'clip'):
+        raise ValueError("mode must be 'filter' or 'clip'")
+    clip_geom = box(*(float(coord) for coord in bbox))
+    # det spatiale indeks finder kandidaterne og tester intersects i ét kald; indekserne sorteres så rækkefølgen bevares
+    idx = np.sort(gdf.sindex.query(clip_geom, predicate='intersects'))
+    tmp_gdf = gdf.iloc[idx]
+    if mode == 'clip':
+        tmp_gdf = gpd.clip(tmp_gdf, clip_geom)
     
     return tmp_gdf
 
-def describeFC(sde, schema='*', feature_class='*'):
-    desc_df = pd.DataFrame(columns=['Feature class', 'Feature type', 'Has M', 'Has Z', 'Coordinate system', 'Coordinate system name', 'Fields', 'Fields dict' 'Spatial Reference'])
+def _describe_one(sde, fc):
+    """Beskriver én feature class og returnerer dens række til describeFC."""
+    # den fulde sti bruges, så arbejdstrådene ikke afhænger af arcpy.env.workspace
+    desc = arcpy.Describe(os.path.join(sde, fc))
+    sr = arcpy.SpatialReference(desc.spatialReference.factoryCode)
+    flds = desc.fields
+    fields = []
+    fields_dict = {}
+    for fld in flds:
+        if fld.name.lower().startswith('shape') or fld.name.lower().startswith('objectid'):
+            continue
+        fldName = str(fld.name)
+        fldType = str(fld.type)
+
+        fldLength = None
+        if fldType.lower() == 'string':
+            fldLength = fld.length
+        
+        if fldName == 'xTid':
+            fldAlias = 'Sidst hentet'
+        else:
+            fldAlias = fld.aliasName
+        fields.append([fldName, _FIELD_TYPES[fldType], fldAlias, fldLength])
+        fields_dict[fldName] = {'Type': _FIELD_TYPES[fldType], 'Alias': fldAlias, 'Length': fldLength}
+
+    return {
+        'Feature class': fc,
+        'Feature type': desc.shapeType,
+        'Has M': desc.hasM,
+        'Has Z': desc.hasZ,
+        'Coordinate system': desc.spatialReference.factoryCode,
+        'Coordinate system name': sr.name,
+        'Fields': fields,
+        'Fields dict': fields_dict,
+        'Spatial Reference': sr
+    }
+
+def describeFC(sde, schema='*', feature_class='*', max_workers=8):
+    """
+    Beskriver feature classes i en geodatabase eller SDE-forbindelse.
+
+    arcpy.Describe venter for det meste på databasen, så feature classes beskrives 
+    samtidigt fra en trådpulje. Sæt max_workers=1 for at beskrive dem én ad gangen.
+
+    Parametre:
+    ----------
+    - sde: Sti til geodatabasen eller .sde-forbindelsesfilen.
+    - schema: Kun feature classes i dette schema. Standard er '*' (alle).
+    - feature_class: Filter til arcpy.ListFeatureClasses. Standard er '*' (alle).
+    - max_workers: Maks antal samtidige arcpy.Describe kald. Standard er 8.
+
+    Returnerer:
+    -----------
+    - En DataFrame med én række pr. feature class i samme rækkefølge som arcpy.ListFeatureClasses.
+    """
     arcpy.env.workspace = sde
     fcs = arcpy.ListFeatureClasses(feature_class, 'ALL')
     if schema != '*':
         fcs = [fc for fc in fcs if fc.split('.')[0].lower() == schema.lower()]
 
-    for fc in fcs:
-        desc = arcpy.Describe(fc)
-        sr = arcpy.SpatialReference(desc.spatialReference.factoryCode)
-        flds = desc.fields
-        fields = []
-        fields_dict = {}
-        for fld in flds:
-            if fld.name.lower().startswith('shape') or fld.name.lower().startswith('objectid'):
-                continue
-            fldName = str(fld.name)
-            fldType = str(fld.type)
-            types = {
-                'Blob': 'BLOB',
-                'BigInteger': 'BIGINTEGER',
-                'Date': 'DATE',
-                'DateOnly': 'DATEONLY',
-                'Double': 'DOUBLE',
-                'Geometry': 'GEOMETRY',
-                'GlobalID': 'GLOBALID',
-                'Guid': 'GUID',
-                'Integer': 'LONG',
-                'OID': 'OID',
-                'Raster': 'RASTER',
-                'Single': 'FLOAT',
-                'SmallInteger': 'SHORT',
-                'String': 'TEXT',
-                'TimeOnly': 'TIMEONLY',
-                'TimeStampOffset': 'TIMESTAMPOFFSET'
-            }
-
-            fldLength = None
-            if fldType.lower() == 'string':
-                fldLength = fld.length
-            
-            if fldName == 'xTid':
-                fldAlias = 'Sidst hentet'
-            else:
-                fldAlias = fld.aliasName
-            fields.append([fldName, types[fldType], fldAlias, fldLength])
-            fields_dict[fldName] = {'Type': types[fldType], 'Alias': fldAlias, 'Length': fldLength}
-
-        new_row = pd.DataFrame([{
-            'Feature class': fc,
-            'Feature type': desc.shapeType,
-            'Has M': desc.hasM,
-            'Has Z': desc.hasZ,
-            'Coordinate system': desc.spatialReference.factoryCode,
-            'Coordinate system name': sr.name,
-            'Fields': fields,
-            'Fields dict': fields_dict,
-            'Spatial Reference': sr
-        }])
-        desc_df = pd.concat([desc_df, new_row], ignore_index=True)
+    # rækkerne samles i en liste, og DataFrame'en bygges én gang til sidst; map bevarer rækkefølgen
+    if max_workers > 1 and len(fcs) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(fcs))) as executor:
+            rows = list(executor.map(partial(_describe_one, sde), fcs))
+    else:
+        rows = [_describe_one(sde, fc) for fc in fcs]
+    desc_df = pd.DataFrame(rows, columns=_DESCRIBE_COLUMNS)
     return desc_df
 
 if __name__ == "__main__":
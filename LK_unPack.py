@@ -5,14 +5,51 @@
 * 'infile' er stien til zip-filen, der skal udpakkes
 * 'outfolder' er stien til mappen, hvor filerne skal udpakkes
 * 'structure' er en boolsk værdi, der angiver, om mappestrukturen skal bevares
+* 'max_workers' angiver antal processer til udpakningen af store zip-filer (standard 1)
 * Returnerer ingen (None)
 """
 
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from zipfile import ZipFile
 
-def unpack(infile, outfolder, structure=False):
+# bufferstørrelse ved kopiering af udpakkede filer; større læsninger giver færre kald end standarden på 16 KB
+_COPY_BUFFER_SIZE = 1024 * 1024
+# under denne samlede udpakkede størrelse koster det mere at starte processer, end der spares
+_PARALLEL_MIN_SIZE = 16 * 1024 * 1024
+
+def _extract_members(infile, outfolder, members, structure):
+    """
+    Pakker de angivne filer ud af zip-filen.
+
+    Bruges både serielt og i arbejdsprocesserne; hver proces åbner sit eget ZipFile-objekt, 
+    da et åbent ZipFile ikke kan deles mellem processer.
+    """
+    with ZipFile(infile) as zObject:
+        for member in members:
+            if structure:
+                try:
+                    zObject.extract(member, outfolder)
+                except FileExistsError:
+                    # en anden proces oprettede mappen samtidig; nu findes den, så der prøves igen
+                    zObject.extract(member, outfolder)
+            else:
+                filename = os.path.basename(member)
+                with zObject.open(member) as source, open(os.path.join(outfolder, filename), 'wb') as target:
+                    shutil.copyfileobj(source, target, length=_COPY_BUFFER_SIZE)
+
+def _split_members(infos, n):
+    """Fordeler filerne i n grupper med omtrent samme udpakkede størrelse; de største fordeles først."""
+    groups = [[] for _ in range(n)]
+    sizes = [0] * n
+    for info in sorted(infos, key=lambda info: info.file_size, reverse=True):
+        i = sizes.index(min(sizes))
+        groups[i].append(info.filename)
+        sizes[i] += info.file_size
+    return [group for group in groups if group]
+
+def unpack(infile, outfolder, structure=False, max_workers=1):
     """
     Udpakker en zip-fil til en angivet mappe med eller uden at bevare mappestrukturen.
 
@@ -20,6 +57,10 @@ def unpack(infile, outfolder, structure=False):
     er sat til `True`, vil den bevare den oprindelige mappestruktur fra zip-filen. Hvis `structure` 
     er `False`, vil alle filer blive udpakket direkte til output-mappen uden mappestrukturen.
 
+    Udpakningen (inflate) er CPU-bunden. Med `max_workers` over 1 fordeles filerne i grupper med 
+    omtrent samme størrelse på flere processer, som hver åbner zip-filen selv. Er den samlede 
+    udpakkede størrelse under 16 MB, pakkes der ud i den kaldende proces.
+
     Parametre:
     ----------
     infile : str
@@ -27,24 +68,40 @@ def unpack(infile, outfolder, structure=False):
     outfolder : str
         Stien til mappen, hvor filerne skal udpakkes.
     structure : bool, valgfri
-        Hvis `True`, bevares mappestrukturen fra zip-filen. Hvis `False`, udpakkes filerne uden struktur. 
-        Standard er `False`.
+        Hvis `True`, bevares mappestrukturen fra zip-filen. Hvis `False`, udpakkes filerne uden struktur; 
+        har flere filer samme navn, beholdes den sidste i zip-filen. Standard er `False`.
+    max_workers : int, valgfri
+        Antal processer til udpakningen. Standard er 1 (ingen ekstra processer). 
+        På Windows skal det kaldende script have en `if __name__ == '__main__':` blok, 
+        når der bruges flere processer.
 
     Returnerer:
     -----------
     Ingen (None).
     """
+    with ZipFile(infile) as zObject:
+        infos = zObject.infolist()
     if structure:
-        with ZipFile(infile,'r') as zObject:
-            zObject.extractall(path=outfolder)
+        # mappe-elementerne pakkes ud først i denne proces; arbejdsprocesserne får kun filer
+        members = [info for info in infos if not info.is_dir()]
+        directories = [info.filename for info in infos if info.is_dir()]
     else:
-        with ZipFile(infile) as zObject:
-            for member in zObject.namelist():
-                filename = os.path.basename(member)
-                if not filename:
-                    continue
-                source = zObject.open(member)
-                target = open(os.path.join(outfolder, filename), 'wb')
-                with source, target:
-                    shutil.copyfileobj(source, target)
-    
\ No newline at end of file
+        # filer med samme navn i forskellige mapper ville overskrive hinanden; kun den sidste pakkes ud, som før
+        by_name = {}
+        for info in infos:
+            if os.path.basename(info.filename):
+                by_name[os.path.basename(info.filename)] = info
+        members = list(by_name.values())
+        directories = []
+
+    if directories:
+        _extract_members(infile, outfolder, directories, structure)
+    total_size = sum(info.file_size for info in members)
+    if max_workers > 1 and len(members) > 1 and total_size >= _PARALLEL_MIN_SIZE:
+        groups = _split_members(members, min(max_workers, len(members)))
+        with ProcessPoolExecutor(max_workers=len(groups)) as executor:
+            futures = [executor.submit(_extract_members, infile, outfolder, group, structure) for group in groups]
+            for future in futures:
+                future.result()
+    else:
+        _extract_members(infile, outfolder, [info.filename for info in members], structure)
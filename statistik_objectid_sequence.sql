@@ -0,0 +1,20 @@
+/*
+************ statistik_objectid_sequence.sql ************
+* Migrering af statistik-tabellen, så SQL Server selv tildeler OBJECTID.
+* Erstat dbo.statistik med værdien af 'statestik_tabel' i DatabaseConnections_args.json.
+* Eksisterende OBJECTID'er bevares, nye rækker får næste værdi fra sekvensen.
+* Når migreringen er kørt, udelader DBConnect.statistik() OBJECTID i INSERT og slår ikke længere MAX(OBJECTID) op.
+*/
+
+DECLARE @tabel NVARCHAR(256) = N'dbo.statistik';
+DECLARE @start INT;
+DECLARE @sql NVARCHAR(MAX);
+
+SET @sql = N'SELECT @start = ISNULL(MAX(OBJECTID), 0) + 1 FROM ' + @tabel;
+EXEC sp_executesql @sql, N'@start INT OUTPUT', @start = @start OUTPUT;
+
+SET @sql = N'CREATE SEQUENCE ' + @tabel + N'_OBJECTID_seq AS INT START WITH ' + CAST(@start AS NVARCHAR(20)) + N' INCREMENT BY 1';
+EXEC sp_executesql @sql;
+
+SET @sql = N'ALTER TABLE ' + @tabel + N' ADD DEFAULT (NEXT VALUE FOR ' + @tabel + N'_OBJECTID_seq) FOR OBJECTID';
+EXEC sp_executesql @sql;
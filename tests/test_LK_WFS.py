@@ -0,0 +1,168 @@
+import json
+import os
+import random
+import sys
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pyproj
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import LK_WFS
+
+BBOX = (570000.0, 6200000.0, 580000.0, 6210000.0)
+SIZE = 200.0
+
+CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<wfs:WFS_Capabilities version="2.0.0" xmlns:wfs="http://www.opengis.net/wfs/2.0" xmlns:ows="http://www.opengis.net/ows/1.1">
+<ows:OperationsMetadata>
+<ows:Operation name="GetCapabilities"><ows:Parameter name="AcceptVersions"><ows:AllowedValues><ows:Value>2.0.0</ows:Value></ows:AllowedValues></ows:Parameter></ows:Operation>
+<ows:Operation name="GetFeature">
+<ows:Parameter name="resultType"><ows:AllowedValues><ows:Value>results</ows:Value><ows:Value>hits</ows:Value></ows:AllowedValues></ows:Parameter>
+<ows:Parameter name="outputFormat"><ows:AllowedValues><ows:Value>application/json</ows:Value></ows:AllowedValues></ows:Parameter>
+</ows:Operation>
+<ows:Operation name="DescribeFeatureType"/>
+</ows:OperationsMetadata>
+<wfs:FeatureTypeList>
+<wfs:FeatureType><wfs:Name>ns:felter</wfs:Name><wfs:Title>felter</wfs:Title>
+<ows:WGS84BoundingBox><ows:LowerCorner>8.0 55.9</ows:LowerCorner><ows:UpperCorner>8.2 56.0</ows:UpperCorner></ows:WGS84BoundingBox></wfs:FeatureType>
+</wfs:FeatureTypeList>
+</wfs:WFS_Capabilities>"""
+
+DESCRIBE = """<?xml version="1.0"?>
+<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema"><xsd:complexType name="feltType"><xsd:complexContent><xsd:sequence>
+<xsd:element name="nr" type="xsd:int"/><xsd:element name="geometry" type="gml:PolygonPropertyType"/>
+</xsd:sequence></xsd:complexContent></xsd:complexType></xsd:schema>"""
+
+
+def _features(n):
+    """Kvadrater i EPSG:25832 med deres koordinater i EPSG:4326, som en RFC 7946 GeoJSON-tjeneste returnerer dem."""
+    rnd = random.Random(1)
+    to_4326 = pyproj.Transformer.from_crs(25832, 4326, always_xy=True)
+    features = []
+    for nr in range(n):
+        x = rnd.uniform(BBOX[0], BBOX[2] - SIZE)
+        y = rnd.uniform(BBOX[1], BBOX[3] - SIZE)
+        ring = [to_4326.transform(cx, cy) for cx, cy in ((x, y), (x + SIZE, y), (x + SIZE, y + SIZE), (x, y + SIZE), (x, y))]
+        features.append(((x, y, x + SIZE, y + SIZE), {'type': 'Feature', 'properties': {'nr': nr}, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}}))
+    return features
+
+
+def _square(nr, x0, y0, x1, y1):
+    """Et rektangel i EPSG:25832 med dets udstrækning, i samme form som _features."""
+    ring = [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+    return (x0, y0, x1, y1), {'type': 'Feature', 'properties': {'nr': nr}, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+
+
+class _MockWFS(BaseHTTPRequestHandler):
+    """WFS 2.0 uden feature id, der svarer i EPSG:4326 og filtrerer bbox'en (EPSG:25832) på featurenes udstrækning."""
+    features = _features(3000)
+    ## CRS der skrives i svaret; None giver RFC 7946 GeoJSON uden crs
+    crs = None
+    ## False returnerer alle features uanset bbox, som en tjeneste med et groft rumligt indeks
+    filter_bbox = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = {k.lower(): v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        request = query.get('request', '').lower()
+        if request == 'getcapabilities':
+            body = CAPABILITIES.encode()
+        elif request == 'describefeaturetype':
+            body = DESCRIBE.encode()
+        elif request == 'getfeature':
+            x0, y0, x1, y1 = (float(v) for v in query['bbox'].split(',')[:4]) if 'bbox' in query else BBOX
+            hits = [f for (fx0, fy0, fx1, fy1), f in self.features if not self.filter_bbox or (fx0 <= x1 and fx1 >= x0 and fy0 <= y1 and fy1 >= y0)]
+            if query.get('resulttype') == 'hits':
+                body = f'<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" numberMatched="{len(hits)}" numberReturned="0"/>'.encode()
+            else:
+                hits = hits[:int(query.get('count', len(hits)))]
+                collection = {'type': 'FeatureCollection', 'features': hits}
+                if self.crs is not None:
+                    collection['crs'] = {'type': 'name', 'properties': {'name': self.crs}}
+                body = json.dumps(collection).encode()
+        else:
+            self.send_response(400)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _ClipMockWFS(_MockWFS):
+    """Svarer i EPSG:25832 med alle features, også dem der krydser eller ligger udenfor den forespurgte bbox."""
+    crs = 'urn:ogc:def:crs:EPSG::25832'
+    filter_bbox = False
+    features = [
+        _square(0, 570100.0, 6200100.0, 570200.0, 6200200.0),   ## indenfor
+        _square(1, 570900.0, 6200400.0, 571100.0, 6200500.0),   ## krydser højre kant
+        _square(2, 569950.0, 6200950.0, 570050.0, 6201050.0),   ## krydser øverste venstre hjørne
+        _square(3, 572000.0, 6200000.0, 572100.0, 6200100.0),   ## helt udenfor
+        _square(4, 571000.0, 6200600.0, 571100.0, 6200700.0),   ## rører kun højre kant; clip_by_rect giver en tom geometri
+    ]
+
+
+class _ServerTestCase(unittest.TestCase):
+    """Starter handler som en lokal WFS på en ledig port for hver test."""
+    handler = _MockWFS
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/wfs'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestGetFeature(_ServerTestCase):
+
+    def test_split_tiles_without_ids_in_other_crs(self):
+        ## felterne overlapper langs snitlinjerne og svaret er i EPSG:4326, så dubletterne skal findes uden feature id
+        with LK_WFS.WFS(self.url, bbox=list(BBOX), maxfeatures=500) as wfs:
+            gdf = wfs.get_feature('felter')
+        self.assertEqual(len(gdf), len(_MockWFS.features))
+        self.assertEqual(gdf['nr'].nunique(), len(_MockWFS.features))
+        self.assertEqual(gdf.crs.to_epsg(), 25832)
+
+
+class TestClip(_ServerTestCase):
+    handler = _ClipMockWFS
+    clip_bbox = (570000.0, 6200000.0, 571000.0, 6201000.0)
+
+    def test_clip_to_bbox(self):
+        with LK_WFS.WFS(self.url, bbox=list(self.clip_bbox), maxfeatures=1000) as wfs:
+            gdf = wfs.get_feature('felter').set_index('nr')
+            unclipped = wfs.get_feature('felter', clip_gdf=False)
+        ## features helt udenfor bbox'en fjernes; de øvrige rækker og kolonner beholdes
+        self.assertEqual(sorted(gdf.index), [0, 1, 2])
+        self.assertEqual(sorted(gdf.reset_index().columns), sorted(unclipped.columns))
+        self.assertEqual(gdf.crs.to_epsg(), 25832)
+        ## geometrier indenfor er uændrede, og de krydsende er skåret til bbox'en
+        self.assertEqual(tuple(gdf.geometry[0].bounds), (570100.0, 6200100.0, 570200.0, 6200200.0))
+        self.assertEqual(tuple(gdf.geometry[1].bounds), (570900.0, 6200400.0, 571000.0, 6200500.0))
+        self.assertEqual(tuple(gdf.geometry[2].bounds), (570000.0, 6200950.0, 570050.0, 6201000.0))
+        self.assertAlmostEqual(gdf.geometry[1].area, 100.0 * 100.0)
+
+    def test_clip_removes_empty_like_full_clip(self):
+        ## kun de klippede rækker tjekkes for tomme geometrier; resultatet skal svare til at klippe og tjekke alle rækker
+        with LK_WFS.WFS(self.url, bbox=list(self.clip_bbox), maxfeatures=1000) as wfs:
+            gdf = wfs.get_feature('felter')
+            unclipped = wfs.get_feature('felter', clip_gdf=False)
+        clipped = shapely.clip_by_rect(unclipped.geometry.values, *self.clip_bbox)
+        expected = unclipped['nr'][~shapely.is_empty(clipped)]
+        self.assertNotIn(4, gdf['nr'].tolist())
+        self.assertEqual(sorted(gdf['nr']), sorted(expected))
+        self.assertFalse(shapely.is_empty(gdf.geometry.values).any())
+
+
+if __name__ == '__main__':
+    unittest.main()